@@ -5,9 +5,16 @@ import json
 import sys
 import os
 import logging
-import pandas as pd
+import math
+from datetime import datetime
+from dateutil import parser as dateutil_parser
 import traceback
 
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard library json
+    orjson = None
+
 # Enable detailed CGI error reporting
 cgitb.enable()
 
@@ -39,11 +46,6 @@ def fallback_get_canonical_id(satellite_id):
     # logger.warning(f"Using fallback get_canonical_id for {satellite_id}")
     return satellite_id
 
-def fallback_get_all_variants(canonical_id):
-    """Fallback function if import fails - returns the canonical ID in a list"""
-    # logger.warning(f"Using fallback get_all_variants for {canonical_id}")
-    return [canonical_id]
-
 def fallback_run_sat_latency_query(start_time, end_time, filters=None):
     """Fallback function if import fails - returns empty list"""
     # logger.error("Using fallback run_sat_latency_query - no data will be returned")
@@ -51,7 +53,6 @@ def fallback_run_sat_latency_query(start_time, end_time, filters=None):
 
 # Set default functions to fallbacks
 get_canonical_id = fallback_get_canonical_id
-get_all_variants = fallback_get_all_variants
 run_sat_latency_query = fallback_run_sat_latency_query
 
 # Try to import the real functions
@@ -75,7 +76,6 @@ import sat_db_functions
 
 # If successful, override the fallback functions
 get_canonical_id = sat_db_functions.get_canonical_id
-get_all_variants = sat_db_functions.get_all_variants
 run_sat_latency_query = sat_db_functions.run_sat_latency_query
 
     # logger.info("Successfully imported from sat_db_functions")
@@ -88,13 +88,133 @@ run_sat_latency_query = sat_db_functions.run_sat_latency_query
 #     logger.error(traceback.format_exc())
 #     logger.error("Will use fallback functions that provide limited functionality")
 
-def data_endpoint():
+# Columns every record must have; missing or null values become 'Not Available'
+DEFAULT_COLUMNS = ['ingest_source', 'coverage', 'instrument', 'band', 'section', 'satellite_id']
+NOT_AVAILABLE = 'Not Available'
+DEFAULT_RECORD = dict.fromkeys(DEFAULT_COLUMNS, NOT_AVAILABLE)
+
+def parse_latency(value):
+    """Coerce a latency value to float, returns None if it is not numeric"""
+    try:
+        latency = float(value)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(latency):
+        return None
+    return latency
+
+def format_start_time(value):
+    """Normalize a start time to 'YYYY-MM-DD HH:MM:SS[.ffffff][+HH:MM]', or 'Not Available'"""
+    if isinstance(value, datetime):
+        return str(value)
+    if not isinstance(value, str):
+        return NOT_AVAILABLE
+    try:
+        # Fast path: records share one ISO-8601 layout
+        return str(datetime.fromisoformat(value.replace('Z', '+00:00')))
+    except ValueError:
+        pass
+    # Only values that failed the fast path go through the slower flexible parser
+    try:
+        return str(dateutil_parser.parse(value))
+    except (ValueError, OverflowError):
+        return NOT_AVAILABLE
+
+def clean_records(data, canonical_id=None):
+    """
+    Clean raw query records in one pass, without building a DataFrame.
+    
+    Args:
+        data (list): Records returned by run_sat_latency_query
+        canonical_id (str): Canonical satellite ID shared by every record, e.g. when
+            the query was filtered to the variants of one satellite. Skips the
+            per-record lookup when given
+    
+    Returns:
+        tuple: (cleaned records, unique instruments, unique coverages), the
+        unique values are listed in order of first appearance
+    """
+    records = []
+    # dicts double as insertion-ordered sets
+    instruments = {}
+    coverages = {}
+    # Only a handful of distinct satellite IDs occur, resolve each one once
+    canonical_ids = {}
+    
+    for raw_record in data:
+        # Normalize column names (case-insensitive matching), filling missing
+        # columns and null values with 'Not Available' in the same pass
+        record = DEFAULT_RECORD.copy()
+        record.update(
+            (key.lower(), NOT_AVAILABLE if value is None else value)
+            for key, value in raw_record.items()
+        )
+        
+        # Drop records without a numeric latency
+        latency = parse_latency(record.get('latency'))
+        if latency is None:
+            continue
+        record['latency'] = latency
+        
+        # The default columns hold a few dozen distinct values across all records;
+        # share one string object per value, like a categorical dtype would
+        for col in DEFAULT_COLUMNS:
+            value = record[col]
+            if type(value) is str:
+                record[col] = sys.intern(value)
+        
+        if canonical_id is not None:
+            record['canonical_satellite_id'] = canonical_id
+        else:
+            # IDs without a mapping keep their original value
+            satellite_id = record['satellite_id']
+            if satellite_id not in canonical_ids:
+                canonical_ids[satellite_id] = get_canonical_id(satellite_id)
+            record['canonical_satellite_id'] = canonical_ids[satellite_id]
+        
+        # Convert timestamps to string for JSON serialization
+        if 'start_time' in record:
+            record['start_time'] = format_start_time(record['start_time'])
+        
+        instruments[record['instrument']] = None
+        coverages[record['coverage']] = None
+        records.append(record)
+    
+    return records, list(instruments), list(coverages)
+
+# Compact separators: no whitespace in the response body
+JSON_SEPARATORS = (',', ':')
+
+def write_json(obj):
+    """Write obj to stdout as compact JSON, using orjson when it is available"""
+    if orjson is not None:
+        # orjson produces bytes; flush the headers written through the text layer first
+        sys.stdout.flush()
+        sys.stdout.buffer.write(orjson.dumps(obj))
+        sys.stdout.buffer.write(b"\n")
+        sys.stdout.buffer.flush()
+        return
+    # Stream without building the whole string first
+    json.dump(obj, sys.stdout, separators=JSON_SEPARATORS)
+    sys.stdout.write("\n")
+
+def encode_json(obj):
+    """Serialize obj to compact UTF-8 JSON bytes, using orjson when it is available"""
+    if orjson is not None:
+        return orjson.dumps(obj) + b"\n"
+    return json.dumps(obj, separators=JSON_SEPARATORS).encode("utf-8") + b"\n"
+
+def data_endpoint(form=None):
     """
     API endpoint to query satellite latency data directly from the database
+    
+    Args:
+        form (cgi.FieldStorage): Query parameters, read from the CGI environment if not given
     """
     try:
         # Get query parameters
-        form = cgi.FieldStorage()
+        if form is None:
+            form = cgi.FieldStorage()
         start_date = form.getvalue("start_date")
         end_date = form.getvalue("end_date")
         start_hour = form.getvalue("start_hour", "00:00")
@@ -115,20 +235,16 @@ def data_endpoint():
         
         # Prepare filters
         filters = {}
+        canonical_id = None
         if satellite_id:
             # Get the canonical form
             # logger.info(f"Getting canonical form for: {satellite_id}")
             canonical_id = get_canonical_id(satellite_id)
             # logger.info(f"Canonical ID: {canonical_id}")
             
-            # Get all variants of this canonical ID
-            all_variants = get_all_variants(canonical_id)
-            # logger.info(f"All variants: {all_variants}")
-            
-            # Use all variants in the filter
-            filters["satellite-id"] = all_variants
-            
-            # logger.info(f"Expanded satellite ID {satellite_id} to variants: {all_variants}")
+            # Filter on the canonical ID, run_sat_latency_query expands it to
+            # all of its variants (the database stores the raw spellings)
+            filters["satellite-id"] = [canonical_id]
         
         if coverage:
             filters["coverage"] = coverage
@@ -152,62 +268,18 @@ def data_endpoint():
             # logger.info("Query returned no data")
             return {"message": "No data available for the selected period.", "data": []}
         
-        # Convert to DataFrame for easier processing
-        # logger.info("Converting to DataFrame...")
-        try:
-            df = pd.DataFrame(data)
-            # logger.info(f"DataFrame created with shape: {df.shape}")
-        except Exception as df_error:
-            # logger.error(f"Error creating DataFrame: {str(df_error)}")
-            # logger.error(traceback.format_exc())
-            return {"message": f"Error creating DataFrame: {str(df_error)}", "data": []}, 500
-        
-        # Clean and process data
+        # Clean and process data in a single pass over the records
         try:
-            # logger.info("Processing DataFrame...")
-            
-            # Normalize column names (case-insensitive matching)
-            df.columns = [col.lower() for col in df.columns]
-            # logger.info(f"Columns after normalization: {list(df.columns)}")
-            
-            # Clean latency data
-            # logger.info("Cleaning latency data...")
-            df['latency'] = pd.to_numeric(df['latency'], errors='coerce')
-            df = df.dropna(subset=['latency'])
-            # logger.info(f"DataFrame shape after cleaning: {df.shape}")
-            
-            # Add missing columns with 'Not Available' default
-            default_columns = ['ingest_source', 'coverage', 'instrument', 'band', 'section', 'satellite_id']
-            for col in default_columns:
-                if col not in df.columns:
-                    # logger.warning(f"Column '{col}' not found. Adding with default value.")
-                    df[col] = 'Not Available'
-            
-            # Fill NaN values with "Not Available"
-            for col in default_columns:
-                df[col] = df[col].fillna('Not Available')
-            
-            # Add canonical_satellite_id column
-            if 'satellite_id' in df.columns:
-                # logger.info("Adding canonical_satellite_id column...")
-                df['canonical_satellite_id'] = df['satellite_id'].apply(get_canonical_id)
-            
-            # Convert timestamps to string for JSON serialization
-            if 'start_time' in df.columns:
-                # logger.info("Converting timestamps...")
-                # Most flexible approach:
-                df['start_time'] = pd.to_datetime(df['start_time'], format='mixed', errors='coerce').astype(str)
-            
-            # Convert to records and handle NaN values
-            # logger.info("Converting to records...")
-            result = df.replace({pd.NA: "Not Available", pd.NaT: "Not Available"}).to_dict(orient="records")
+            # logger.info("Processing records...")
+            # A satellite filter already fixed the canonical ID of every returned record
+            result, instruments, coverages = clean_records(data, canonical_id)
             # logger.info(f"Created {len(result)} result records")
             
             return {
                 "data": result,
                 "metadata": {
-                    "instruments": df['instrument'].unique().tolist(),
-                    "coverages": df['coverage'].unique().tolist(),
+                    "instruments": instruments,
+                    "coverages": coverages,
                     "total_records": len(result)
                 }
             }
@@ -222,6 +294,35 @@ def data_endpoint():
         # logger.error(traceback.format_exc())
         return {"message": f"Internal Server Error: {str(e)}", "data": []}, 500
 
+def application(environ, start_response):
+    """
+    WSGI entry point, so data.py can run in a long-lived process (e.g. Apache
+    mod_wsgi) instead of starting a new interpreter for every CGI request.
+    The imports above, and anything sat_db_functions caches, then persist
+    across requests.
+    """
+    try:
+        form = cgi.FieldStorage(fp=environ.get("wsgi.input"), environ=environ)
+        result = data_endpoint(form)
+        
+        # Handle tuple returns (for error responses)
+        response_data = result[0] if isinstance(result, tuple) else result
+    except Exception as final_error:
+        response_data = {
+            "error": "Critical error in script execution",
+            "message": str(final_error),
+            "data": []
+        }
+    
+    # Like the CGI script, always answer 200 and report errors in the body,
+    # which is what the viewer's JavaScript expects
+    body = encode_json(response_data)
+    start_response("200 OK", [
+        ("Content-Type", "application/json"),
+        ("Content-Length", str(len(body)))
+    ])
+    return [body]
+
 # Main entry point for CGI
 if __name__ == "__main__":
     # Set content-type header for JSON response
@@ -242,7 +343,7 @@ if __name__ == "__main__":
         
         # Print JSON response
         # logger.info(f"Returning response with status code {status_code} and {len(response_data.get('data', []))} records")
-        print(json.dumps(response_data))
+        write_json(response_data)
         
     except Exception as final_error:
         # logger.error(f"Final error in main block: {str(final_error)}")
@@ -254,4 +355,4 @@ if __name__ == "__main__":
             "message": str(final_error),
             "data": []
         }
-        print(json.dumps(error_response))
\ No newline at end of file
+        write_json(error_response)
\ No newline at end of file
@@ -10,6 +10,7 @@ This script:
 Example usage:
     python generate_satellite_relationships.py -o satellite_relationships.json
     python generate_satellite_relationships.py -d 2025-02-27 -n 7 -o satellite_relationships.json
+    python generate_satellite_relationships.py -c ~/.cache/sat_relationships -o satellite_relationships.json
 """
 
 import os
@@ -17,10 +18,25 @@ import json
 import argparse
 import logging
 import subprocess
-import tempfile
+import threading
+from itertools import chain, islice
 from datetime import datetime, timedelta
 from collections import defaultdict
 
+import pandas as pd
+
+from satellite_ids import SATELLITE_ID_MAPPINGS, get_canonical_id
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard library json
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # ijson is optional, without it the whole output is parsed at once
+    ijson = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -31,44 +47,14 @@ logger = logging.getLogger(__name__)
 # Path to satellite data directory
 SATELLITE_DATA_DIR = "/data/sat_latency"
 
-# Hard-coded mapping of satellite ID variations to canonical IDs
-SATELLITE_ID_MAPPINGS = {
-    # Format: 'variant': 'canonical'
-    'G16': 'G16',
-    'g16': 'G16',
-    'G18': 'G18',
-    'g18': 'G18',
-    'G19': 'G19',
-    'g19': 'G19',
-    'DMSP-17': 'DMSP-17',
-    'dmsp17': 'DMSP-17',
-    'DMSP-18': 'DMSP-18',
-    'dmsp18': 'DMSP-18',
-    'DMSP-16': 'DMSP-16',
-    'dmsp16': 'DMSP-16',
-    'NOAA-19': 'NOAA-19',
-    'n19': 'NOAA-19',
-    'NOAA-20': 'NOAA-20',
-    'n20': 'NOAA-20',
-    'NOAA-21': 'NOAA-21',
-    'n21': 'NOAA-21',
-    'NOAA-18': 'NOAA-18',
-    'n18': 'NOAA-18',
-    'NOAA-15': 'NOAA-15',
-    'n15': 'NOAA-15',
-    # Add more mappings as needed
-}
+# How many records to load into a DataFrame at a time when extracting relationships
+RECORD_CHUNK_SIZE = 100000
 
 # Create reverse mapping (canonical to variants)
-CANONICAL_TO_VARIANTS = {}
+_canonical_to_variants = defaultdict(list)
 for variant, canonical in SATELLITE_ID_MAPPINGS.items():
-    if canonical not in CANONICAL_TO_VARIANTS:
-        CANONICAL_TO_VARIANTS[canonical] = []
-    CANONICAL_TO_VARIANTS[canonical].append(variant)
-
-def get_canonical_id(satellite_id):
-    """Get canonical ID for a satellite ID variant"""
-    return SATELLITE_ID_MAPPINGS.get(satellite_id, satellite_id)
+    _canonical_to_variants[canonical].append(variant)
+CANONICAL_TO_VARIANTS = dict(_canonical_to_variants)
 
 def get_date_range(end_date_str=None, num_days=7):
     """
@@ -104,7 +90,8 @@ def run_sat_latency_query(start_date_str, end_date_str):
         end_date_str: End date string in YYYY-MM-DD format
         
     Returns:
-        list: Data returned by sat_latency_interface or None if error
+        iterable: Records returned by sat_latency_interface or None if error.
+        The records are parsed lazily when ijson is installed, see _stream_query_records
     """
     # Build start and end time strings
     start_time = f"{start_date_str}T00:00:00"
@@ -118,30 +105,24 @@ def run_sat_latency_query(start_date_str, end_date_str):
     logger.info(f"Running command: {cmd}")
     
     try:
-        # Create a temporary shell script to run the command
-        with tempfile.NamedTemporaryFile(suffix='.sh', mode='w', delete=False) as temp_script:
-            script_path = temp_script.name
-            temp_script.write("#!/bin/bash\n")
-            temp_script.write(cmd + "\n")
-        
-        # Make the script executable
-        os.chmod(script_path, 0o755)
-        
-        # Run the script using sudo as the oper user
-        sudo_cmd = ["sudo", "-u", "oper", "-i", script_path]
+        # Run the command directly in the oper user's login environment
+        # (needed for `module` and ~), no temporary script required
+        sudo_cmd = ["sudo", "-u", "oper", "-i", "bash", "-c", cmd]
         
         logger.info(f"Executing: {' '.join(sudo_cmd)}")
         
+        if ijson is not None:
+            return _stream_query_records(sudo_cmd)
+        
         # Use PIPE for stdout and stderr
-        process = subprocess.Popen(
-            sudo_cmd, 
-            stdout=subprocess.PIPE, 
+        process = subprocess.run(
+            sudo_cmd,
+            stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            universal_newlines=True
+            universal_newlines=True,
+            check=False
         )
-        
-        # Get the output and error
-        stdout, stderr = process.communicate()
+        stdout, stderr = process.stdout, process.stderr
         
         # Check if the command was successful
         if process.returncode != 0:
@@ -157,7 +138,7 @@ def run_sat_latency_query(start_date_str, end_date_str):
             
         # Parse the JSON output
         try:
-            data = json.loads(stdout)
+            data = orjson.loads(stdout) if orjson is not None else json.loads(stdout)
             logger.info(f"Successfully parsed JSON data: {len(data)} records found")
             return data
         except json.JSONDecodeError as e:
@@ -168,111 +149,308 @@ def run_sat_latency_query(start_date_str, end_date_str):
     except Exception as e:
         logger.error(f"Error executing command: {str(e)}")
         return None
-    finally:
-        # Clean up temporary script
-        if os.path.exists(script_path):
-            os.remove(script_path)
 
-def extract_relationships_from_data(data):
+def _stream_query_records(sudo_cmd):
     """
-    Extract relationship information from satellite data.
+    Run the query command and parse its JSON output incrementally with ijson,
+    so the output is never held in memory all at once.
     
     Args:
-        data: List of satellite data records
+        sudo_cmd: The command to run
         
     Returns:
-        dict: Structured relationship information
+        iterator: Records as they are parsed, or None if the command produced no
+        records. Once exhausted, raises subprocess.CalledProcessError if the
+        command failed
     """
-    if not data:
-        logger.error("No data to process")
+    process = subprocess.Popen(sudo_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    
+    # Drain stderr in the background so the command can't block on a full pipe
+    stderr_chunks = []
+    stderr_thread = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+    stderr_thread.start()
+    
+    def finish():
+        """Wait for the command to exit, returns its exit code and stderr"""
+        process.stdout.close()
+        returncode = process.wait()
+        stderr_thread.join()
+        return returncode, b"".join(stderr_chunks).decode("utf-8", errors="replace")
+    
+    records = ijson.items(process.stdout, 'item', use_float=True)
+    try:
+        first_record = next(records)
+    except StopIteration:
+        returncode, stderr = finish()
+        if returncode != 0:
+            logger.error(f"Command failed with exit code {returncode}: {stderr}")
+        else:
+            logger.warning("Command returned no records")
         return None
-        
-    # Log sample of the data to debug column names
-    if data and len(data) > 0:
-        logger.info(f"Sample data record keys: {list(data[0].keys())}")
-        logger.info(f"Sample data record: {json.dumps(data[0], indent=2)}")
-    
-    # Initialize collections
-    all_satellites = set()
-    all_coverages = set()
-    all_instruments = set()
-    relationships = defaultdict(lambda: {
-        'coverages': set(),
-        'instruments': set(),
-        'coverage_instruments': defaultdict(set)
+    except ijson.JSONError as e:
+        # The command may still be writing, don't wait on it to finish
+        running = process.poll() is None
+        if running:
+            process.kill()
+        returncode, stderr = finish()
+        if returncode != 0 and not running:
+            logger.error(f"Command failed with exit code {returncode}: {stderr}")
+        else:
+            logger.error(f"Failed to parse JSON output: {e}")
+        return None
+    
+    def iter_records():
+        try:
+            yield first_record
+            yield from records
+        except BaseException:
+            # Includes GeneratorExit, when the consumer stops early
+            process.kill()
+            finish()
+            raise
+        returncode, stderr = finish()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, sudo_cmd, stderr=stderr)
+    
+    return iter_records()
+
+def _coalesce_columns(df, *names):
+    """
+    Combine the case variations of a column, taking the first non-empty value.
+    
+    Returns:
+        pd.Series: The combined column, 'Not Available' where every variation is empty
+    """
+    column = pd.Series(None, index=df.index, dtype=object)
+    for name in names:
+        if name in df.columns:
+            # Treat empty strings like missing values
+            column = column.fillna(df[name].where(df[name] != ''))
+    return column.fillna('Not Available')
+
+def _distinct_triples(df):
+    """
+    Extract the satellite_id, coverage and instrument fields from raw records.
+    
+    Returns:
+        pd.DataFrame: The distinct (satellite_id, coverage, instrument) triples
+    """
+    # Extract fields, handling case variations in column names and null values
+    triples = pd.DataFrame({
+        'satellite_id': _coalesce_columns(df, 'satellite_id', 'satellite_ID', 'SATELLITE_ID'),
+        'coverage': _coalesce_columns(df, 'coverage', 'COVERAGE'),
+        'instrument': _coalesce_columns(df, 'instrument', 'INSTRUMENT'),
     })
     
-    # Process each record
-    for record in data:
-        # Extract satellite ID (handle case variations in column name)
-        satellite_id = record.get('satellite_id') or record.get('satellite_ID') or record.get('SATELLITE_ID')
-        if not satellite_id:
-            satellite_id = 'Not Available'
-        
-        # Extract coverage and instrument (handle case variations and null values)
-        coverage = record.get('coverage') or record.get('COVERAGE')
-        if not coverage or coverage is None:
-            coverage = 'Not Available'
-        
-        instrument = record.get('instrument') or record.get('INSTRUMENT')
-        if not instrument or instrument is None:
-            instrument = 'Not Available'
+    # Only distinct triples matter for the output, and there are far fewer
+    # of them than raw records
+    return triples.drop_duplicates(ignore_index=True)
+
+def collect_distinct_triples(data):
+    """
+    Collect the distinct (satellite_id, coverage, instrument) triples of satellite data.
+    
+    Args:
+        data: Iterable of satellite data records, consumed once
         
-        # Get canonical satellite ID
-        canonical_id = get_canonical_id(satellite_id)
+    Returns:
+        pd.DataFrame: The distinct triples, or None if there are no records
+    """
+    records = iter(data or ())
+    first_record = next(records, None)
+    if first_record is None:
+        logger.error("No data to process")
+        return None
         
-        # Add to collections
-        all_satellites.add(satellite_id)  # Track original IDs first
-        all_coverages.add(coverage)
-        all_instruments.add(instrument)
+    # Log sample of the data to debug column names
+    logger.info(f"Sample data record keys: {list(first_record.keys())}")
+    logger.info(f"Sample data record: {json.dumps(first_record, indent=2)}")
+    records = chain([first_record], records)
+    
+    # Load the records a chunk at a time, keeping only the distinct triples of
+    # each chunk so memory stays bounded however many records there are
+    frames = []
+    record_count = 0
+    while True:
+        chunk = list(islice(records, RECORD_CHUNK_SIZE))
+        if not chunk:
+            break
+        record_count += len(chunk)
+        frames.append(_distinct_triples(pd.DataFrame.from_records(chunk)))
+    df = pd.concat(frames, ignore_index=True).drop_duplicates(ignore_index=True)
+    logger.info(f"Found {len(df)} distinct satellite/coverage/instrument triples in {record_count} records")
+    return df
+
+def relationships_from_triples(df):
+    """
+    Build the relationship information from distinct triples.
+    
+    Args:
+        df: DataFrame of distinct (satellite_id, coverage, instrument) triples
         
-        # Update relationships for the canonical ID
-        relationships[canonical_id]['coverages'].add(coverage)
-        relationships[canonical_id]['instruments'].add(instrument)
-        relationships[canonical_id]['coverage_instruments'][coverage].add(instrument)
+    Returns:
+        dict: Structured relationship information
+    """
+    # Get canonical satellite IDs (looked up once per distinct ID), IDs without a
+    # mapping keep their original value. The grouping below runs in pandas' C code
+    sat_ids = df['satellite_id']
+    df = df.assign(canonical_id=sat_ids.map({sat_id: get_canonical_id(sat_id) for sat_id in sat_ids.unique()}))
+    
+    by_satellite = df.groupby('canonical_id')
+    satellite_groups = by_satellite['satellite_id'].unique()
+    coverages_by_satellite = by_satellite['coverage'].unique()
+    instruments_by_satellite = by_satellite['instrument'].unique()
+    instruments_by_coverage = df.groupby(['canonical_id', 'coverage'])['instrument'].unique()
     
-    # Convert sets to lists for JSON serialization
+    # Convert to sorted lists for JSON serialization
     result = {
-        "satellites": [],  # We'll populate this with consolidated IDs
-        "coverages": sorted(list(all_coverages)),
-        "instruments": sorted(list(all_instruments)),
+        # Use canonical IDs as the satellite list
+        "satellites": sorted(satellite_groups.index),
+        "coverages": sorted(df['coverage'].unique()),
+        "instruments": sorted(df['instrument'].unique()),
         "relationships": {}
     }
     
-    # Group satellites by canonical ID
-    satellite_groups = defaultdict(list)
-    for sat_id in all_satellites:
-        canonical_id = get_canonical_id(sat_id)
-        satellite_groups[canonical_id].append(sat_id)
-    
-    # Use canonical IDs as the satellite list
-    result["satellites"] = sorted(list(satellite_groups.keys()))
-    
     # Add satellite variant information
     result["satellite_variants"] = {
-        canonical: variants for canonical, variants in satellite_groups.items()
+        canonical: list(variants) for canonical, variants in satellite_groups.items()
     }
     
-    # Convert relationships to lists for JSON serialization
-    for sat_id, rel in relationships.items():
+    for sat_id in satellite_groups.index:
         result["relationships"][sat_id] = {
-            "coverages": sorted(list(rel["coverages"])),
-            "instruments": sorted(list(rel["instruments"])),
-            "coverage_instruments": {
-                cov: sorted(list(instruments)) 
-                for cov, instruments in rel["coverage_instruments"].items()
-            }
+            "coverages": sorted(coverages_by_satellite[sat_id]),
+            "instruments": sorted(instruments_by_satellite[sat_id]),
+            "coverage_instruments": {}
         }
+    for (sat_id, coverage), instruments in instruments_by_coverage.items():
+        result["relationships"][sat_id]["coverage_instruments"][coverage] = sorted(instruments)
     
     return result
 
-def generate_satellite_relationships(end_date_str=None, num_days=7):
+def extract_relationships_from_data(data):
+    """
+    Extract relationship information from satellite data.
+    
+    Args:
+        data: Iterable of satellite data records, consumed once
+        
+    Returns:
+        dict: Structured relationship information
+    """
+    df = collect_distinct_triples(data)
+    if df is None:
+        return None
+    return relationships_from_triples(df)
+
+def _cache_file(cache_dir, start_date, end_date):
+    """Path of the cached distinct triples for a date range"""
+    return os.path.join(cache_dir, f"triples_{start_date}_{end_date}.parquet")
+
+def _data_mtime_ns(date_range):
+    """
+    Latest modification time of the satellite data covering the given dates.
+    
+    The pipeline appends to one file per day, SATELLITE_DATA_DIR/YYYY/YYYY_MM/
+    YYYY_MM_DD_latencies.arrows. For a day without a file yet, the closest
+    existing parent directory counts instead, as creating the file updates it.
+    
+    Args:
+        date_range: List of date strings in YYYY-MM-DD format
+        
+    Returns:
+        int: Modification time in nanoseconds
+        
+    Raises:
+        OSError: SATELLITE_DATA_DIR can't be checked
+    """
+    latest = os.stat(SATELLITE_DATA_DIR).st_mtime_ns
+    for date_str in date_range:
+        year, month, day = date_str.split('-')
+        year_dir = os.path.join(SATELLITE_DATA_DIR, year)
+        month_dir = os.path.join(year_dir, f"{year}_{month}")
+        day_file = os.path.join(month_dir, f"{year}_{month}_{day}_latencies.arrows")
+        for path in (day_file, month_dir, year_dir):
+            try:
+                latest = max(latest, os.stat(path).st_mtime_ns)
+                break
+            except FileNotFoundError:
+                continue
+    return latest
+
+# Parquet schema metadata key recording the data mtime a cache was built from
+_CACHE_MTIME_KEY = b"data_mtime_ns"
+
+def read_triples_cache(cache_file, data_mtime):
+    """
+    Read cached distinct triples, if they were built from the current satellite data.
+    
+    Args:
+        cache_file: Cache file path
+        data_mtime: Current modification time of the data covered by the cache,
+            see _data_mtime_ns
+        
+    Returns:
+        pd.DataFrame: The cached triples, or None if there is no usable cache
+    """
+    try:
+        import pyarrow.parquet as pq
+        table = pq.read_table(cache_file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # e.g. pyarrow is not installed or the file is corrupt
+        logger.warning(f"Could not read cache {cache_file}: {str(e)}")
+        return None
+    
+    # New data landing in the files of the cached dates invalidates the cache
+    cached_mtime = (table.schema.metadata or {}).get(_CACHE_MTIME_KEY)
+    if cached_mtime != str(data_mtime).encode():
+        logger.info(f"Cache {cache_file} was built from older data in {SATELLITE_DATA_DIR}, ignoring it")
+        return None
+    
+    df = table.to_pandas()
+    logger.info(f"Loaded {len(df)} distinct triples from cache {cache_file}")
+    return df
+
+def write_triples_cache(df, cache_file, data_mtime):
+    """
+    Cache distinct triples as Parquet, failures are logged and otherwise ignored.
+    
+    Args:
+        df: DataFrame of distinct triples
+        cache_file: Cache file path
+        data_mtime: Modification time of the data, taken before it was queried
+    """
+    # Write to a temporary file first so a concurrent run never reads a partial cache
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            _CACHE_MTIME_KEY: str(data_mtime).encode(),
+        })
+        os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+        pq.write_table(table, tmp_file)
+        os.replace(tmp_file, cache_file)
+        logger.info(f"Cached {len(df)} distinct triples to {cache_file}")
+    except Exception as e:
+        logger.warning(f"Could not write cache {cache_file}: {str(e)}")
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+
+def generate_satellite_relationships(end_date_str=None, num_days=7, cache_dir=None):
     """
     Generate satellite relationships JSON by querying data for the specified date range.
     
     Args:
         end_date_str: End date string in YYYY-MM-DD format, or None for yesterday
         num_days: Number of days to go back
+        cache_dir: Directory caching the distinct triples of each date range as
+            Parquet, or None to always run the query
         
     Returns:
         dict: Structured relationship information
@@ -286,15 +464,42 @@ def generate_satellite_relationships(end_date_str=None, num_days=7):
     
     logger.info(f"Generating satellite relationships for date range: {start_date} to {end_date}")
     
-    # Fetch data for the specified date range
-    data = run_sat_latency_query(start_date, end_date)
+    # Reuse the triples of a previous run when the data hasn't changed since.
+    # The data mtime is taken before querying, so rows appended while the query
+    # runs make the cache stale instead of being missed by it
+    cache_file = _cache_file(cache_dir, start_date, end_date) if cache_dir else None
+    data_mtime = None
+    if cache_file:
+        try:
+            data_mtime = _data_mtime_ns(date_range)
+        except OSError as e:
+            # If the data can't be checked, don't use the cache
+            logger.warning(f"Could not check {SATELLITE_DATA_DIR}, not caching: {str(e)}")
+    triples = read_triples_cache(cache_file, data_mtime) if data_mtime is not None else None
     
-    if not data:
-        logger.error(f"Failed to get data for range {start_date} to {end_date}")
-        return None
+    if triples is None:
+        # Fetch data for the specified date range
+        data = run_sat_latency_query(start_date, end_date)
+        
+        if not data:
+            logger.error(f"Failed to get data for range {start_date} to {end_date}")
+            return None
+        
+        try:
+            triples = collect_distinct_triples(data)
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Command failed with exit code {e.returncode}: {e.stderr}")
+            return None
+        except Exception as e:
+            # e.g. the streamed output turned out to be malformed part way through
+            logger.error(f"Error reading query output: {str(e)}")
+            return None
+        
+        if triples is not None and data_mtime is not None:
+            write_triples_cache(triples, cache_file, data_mtime)
     
     # Extract relationships from data
-    result = extract_relationships_from_data(data)
+    result = relationships_from_triples(triples) if triples is not None else None
     
     if not result:
         logger.error("Failed to extract relationships from data")
@@ -321,8 +526,12 @@ def save_relationships_json(relationships, output_file):
         bool: True if successful, False otherwise
     """
     try:
-        with open(output_file, 'w') as f:
-            json.dump(relationships, f, indent=2)
+        if orjson is not None:
+            with open(output_file, 'wb') as f:
+                f.write(orjson.dumps(relationships, option=orjson.OPT_INDENT_2))
+        else:
+            with open(output_file, 'w') as f:
+                json.dump(relationships, f, indent=2)
         
         logger.info(f"Successfully wrote relationships to {output_file}")
         logger.info(f"Found {len(relationships['satellites'])} satellites, "
@@ -338,11 +547,13 @@ def main():
     parser.add_argument('-d', '--date', help='End date to query (YYYY-MM-DD). Defaults to yesterday')
     parser.add_argument('-n', '--days', type=int, default=7, help='Number of days to analyze (default: 7)')
     parser.add_argument('-o', '--output', default='satellite_relationships.json', help='Output JSON file path')
+    parser.add_argument('-c', '--cache-dir', help='Directory to cache query results in (Parquet, needs pyarrow). '
+                        'Reruns for the same date range skip the query until new data arrives')
     
     args = parser.parse_args()
     
     # Generate relationships JSON
-    result = generate_satellite_relationships(args.date, args.days)
+    result = generate_satellite_relationships(args.date, args.days, args.cache_dir)
     
     if not result:
         logger.error("Failed to generate relationships JSON")
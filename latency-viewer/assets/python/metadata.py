@@ -1,8 +1,15 @@
 #!/home/oper/py39env/bin/python
 import cgi
 import json
+import mmap
 import os
 import sys
+from collections import defaultdict
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard library json
+    orjson = None
 
 # Print headers
 print("Content-Type: application/json")
@@ -11,38 +18,31 @@ print()  # Empty line after headers
 # Get script directory
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Satellite ID mappings
-SATELLITE_ID_MAPPINGS = {
-    'G16': 'G16', 'g16': 'G16',
-    'G18': 'G18', 'g18': 'G18',
-    'G19': 'G19', 'g19': 'G19',
-    'DMSP-17': 'DMSP-17', 'dmsp17': 'DMSP-17',
-    'DMSP-18': 'DMSP-18', 'dmsp18': 'DMSP-18',
-    'DMSP-16': 'DMSP-16', 'dmsp16': 'DMSP-16',
-    'NOAA-19': 'NOAA-19', 'n19': 'NOAA-19',
-    'NOAA-20': 'NOAA-20', 'n20': 'NOAA-20',
-    'NOAA-21': 'NOAA-21', 'n21': 'NOAA-21'
-}
+# The shared satellite ID mappings live next to this script, which isn't on
+# the path when it is loaded by a WSGI server
+if script_dir not in sys.path:
+    sys.path.append(script_dir)
+import satellite_ids
+from satellite_ids import get_canonical_id
 
-try:
-    # Define the path to the relationships file
-    relationships_file = os.path.join(script_dir, "satellite_relationships.json")
-    
-    # Check if file exists
-    if not os.path.exists(relationships_file):
-        print(json.dumps({
-            "error": f"Relationships file not found: {relationships_file}",
-            "satellites": [],
-            "coverages": [],
-            "instruments": [],
-            "relationships": {}
-        }))
-        sys.exit(0)
-    
-    # Load the relationships data
-    with open(relationships_file, 'r') as f:
-        raw_relationships = json.load(f)
-    
+# Compact separators: no whitespace in the response body
+JSON_SEPARATORS = (',', ':')
+
+def write_json(obj):
+    """Write obj to stdout as compact JSON, using orjson when it is available"""
+    if orjson is not None:
+        # orjson produces bytes; flush the headers written through the text layer first
+        sys.stdout.flush()
+        sys.stdout.buffer.write(orjson.dumps(obj))
+        sys.stdout.buffer.write(b"\n")
+        sys.stdout.buffer.flush()
+        return
+    # Stream without building the whole string first
+    json.dump(obj, sys.stdout, separators=JSON_SEPARATORS)
+    sys.stdout.write("\n")
+
+def normalize_relationships(raw_relationships):
+    """Consolidate raw relationships data under canonical satellite IDs"""
     # Create normalized data structure
     normalized_data = {
         "satellites": [],
@@ -53,14 +53,10 @@ try:
     }
     
     # Group satellites by canonical ID
-    satellite_groups = {}
+    satellite_groups = defaultdict(list)
     for sat_id in raw_relationships.get("satellites", []):
-        canonical_id = SATELLITE_ID_MAPPINGS.get(sat_id, sat_id)
-        
-        if canonical_id not in satellite_groups:
-            satellite_groups[canonical_id] = []
-        
-        satellite_groups[canonical_id].append(sat_id)
+        satellite_groups[get_canonical_id(sat_id)].append(sat_id)
+    satellite_groups = dict(satellite_groups)
     
     # Use canonical IDs as the satellite list
     normalized_data["satellites"] = sorted(satellite_groups.keys())
@@ -69,56 +65,111 @@ try:
     normalized_data["satellite_variants"] = satellite_groups
     
     # Merge relationships for each canonical ID
+    raw_relationship_map = raw_relationships.get("relationships", {})
     for canonical_id, variants in satellite_groups.items():
-        normalized_data["relationships"][canonical_id] = {
-            "coverages": [],
-            "instruments": [],
-            "coverage_instruments": {}
-        }
+        # Accumulate into sets so merging is linear in the number of entries
+        coverages = set()
+        instruments = set()
+        coverage_instruments = defaultdict(set)
         
         # Merge relationship data from all variants
         for variant_id in variants:
-            if variant_id not in raw_relationships.get("relationships", {}):
+            if variant_id not in raw_relationship_map:
                 continue
                 
-            original_relationship = raw_relationships["relationships"][variant_id]
-            
-            # Merge coverages
-            for coverage in original_relationship.get("coverages", []):
-                if coverage not in normalized_data["relationships"][canonical_id]["coverages"]:
-                    normalized_data["relationships"][canonical_id]["coverages"].append(coverage)
-            
-            # Merge instruments
-            for instrument in original_relationship.get("instruments", []):
-                if instrument not in normalized_data["relationships"][canonical_id]["instruments"]:
-                    normalized_data["relationships"][canonical_id]["instruments"].append(instrument)
-            
-            # Merge coverage_instruments
-            for coverage, instruments in original_relationship.get("coverage_instruments", {}).items():
-                if coverage not in normalized_data["relationships"][canonical_id]["coverage_instruments"]:
-                    normalized_data["relationships"][canonical_id]["coverage_instruments"][coverage] = []
-                
-                for instrument in instruments:
-                    if instrument not in normalized_data["relationships"][canonical_id]["coverage_instruments"][coverage]:
-                        normalized_data["relationships"][canonical_id]["coverage_instruments"][coverage].append(instrument)
+            original_relationship = raw_relationship_map[variant_id]
+            coverages.update(original_relationship.get("coverages", []))
+            instruments.update(original_relationship.get("instruments", []))
+            for coverage, coverage_instrument_list in original_relationship.get("coverage_instruments", {}).items():
+                coverage_instruments[coverage].update(coverage_instrument_list)
         
         # Sort arrays for consistent output
-        normalized_data["relationships"][canonical_id]["coverages"].sort()
-        normalized_data["relationships"][canonical_id]["instruments"].sort()
-        
-        for coverage in normalized_data["relationships"][canonical_id]["coverage_instruments"]:
-            normalized_data["relationships"][canonical_id]["coverage_instruments"][coverage].sort()
+        normalized_data["relationships"][canonical_id] = {
+            "coverages": sorted(coverages),
+            "instruments": sorted(instruments),
+            "coverage_instruments": {
+                coverage: sorted(coverage_instrument_set)
+                for coverage, coverage_instrument_set in coverage_instruments.items()
+            }
+        }
+    
+    return normalized_data
+
+# Normalized responses cached on disk, as each CGI request is a new process.
+# The cache records the (mtime, size) of the relationships file, this script
+# and satellite_ids, so replacing any of them (even with an older mtime, e.g.
+# by cp -p or rsync -t) or editing the mappings invalidates it
+def _source_key(relationships_file):
+    """Identify the versions of the files the normalized response is built from"""
+    stats = [os.stat(path) for path in (relationships_file, __file__, satellite_ids.__file__)]
+    return " ".join(f"{st.st_mtime_ns}:{st.st_size}" for st in stats)
+
+def load_normalized_response(relationships_file):
+    """Get the normalized relationships as a JSON string, using the cache when fresh"""
+    source_key = _source_key(relationships_file)
+    
+    # The first line of the cache file holds the source key, the compact JSON
+    # response (without line breaks) follows on the second
+    cache_file = relationships_file + ".normalized.cache"
+    try:
+        with open(cache_file, 'r') as f:
+            cached_key, _, response = f.read().partition("\n")
+        if cached_key == source_key and response:
+            return response
+    except OSError:
+        pass  # No usable cache file, normalize from scratch
+    
+    if orjson is not None:
+        # Parse straight from the mapped file instead of reading it into a copy first
+        with open(relationships_file, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+                memoryview(mapped) as view:
+            raw_relationships = orjson.loads(view)
+        response = orjson.dumps(normalize_relationships(raw_relationships)).decode('utf-8')
+    else:
+        with open(relationships_file, 'r') as f:
+            raw_relationships = json.load(f)
+        response = json.dumps(normalize_relationships(raw_relationships), separators=JSON_SEPARATORS)
+    
+    # Write the cache atomically so concurrent requests never read a partial file
+    try:
+        temp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'w') as f:
+            f.write(source_key)
+            f.write("\n")
+            f.write(response)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        pass  # Caching is best effort, e.g. the directory may not be writable
+    
+    return response
+
+try:
+    # Define the path to the relationships file
+    relationships_file = os.path.join(script_dir, "satellite_relationships.json")
+    
+    # Check if file exists
+    if not os.path.exists(relationships_file):
+        write_json({
+            "error": f"Relationships file not found: {relationships_file}",
+            "satellites": [],
+            "coverages": [],
+            "instruments": [],
+            "relationships": {}
+        })
+        sys.exit(0)
     
     # Return the normalized data
-    print(json.dumps(normalized_data))
+    sys.stdout.write(load_normalized_response(relationships_file))
+    sys.stdout.write("\n")
 
 except Exception as e:
     import traceback
-    print(json.dumps({
+    write_json({
         "error": str(e),
         "traceback": traceback.format_exc(),
         "satellites": [],
         "coverages": [],
         "instruments": [],
         "relationships": {}
-    }))
\ No newline at end of file
+    })
\ No newline at end of file
@@ -1,163 +1,158 @@
 #!/home/oper/py39env/bin/python
 import os
 import json
+import time
 import logging
-import pandas as pd
+import functools
+import threading
 from datetime import datetime, timezone,timedelta
+from collections import OrderedDict
+import polars as pl
 from sat_latency.interface import satellite_data_from_filters
+from satellite_ids import get_all_variants, get_canonical_id
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard library json
+    orjson = None
 
-# Custom JSON encoder to handle datetime objects
-class DateTimeEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, (datetime, pd.Timestamp)):
-            return obj.isoformat()
-        return super().default(obj)
-                               
 # Set up logging
 logger = logging.getLogger()
 
 # Path to database
 SATELLITE_DATA_DIR = "/data/sat_latency"  # Path to your latency database
-RELATIONSHIPS_FILE = "satellite_relationships.json"  # Path to your prebuilt relationships file
-
-# Hard-coded mapping of satellite ID variations to canonical IDs
-# This makes it easy for future developers to add or modify mappings
-SATELLITE_ID_MAPPINGS = {
-    # Format: 'variant': 'canonical'
-    'G16': 'G16',
-    'g16': 'G16',
-    'G18': 'G18',
-    'g18': 'G18',
-    'G19': 'G19',
-    'g19': 'G19',
-    'DMSP-17': 'DMSP-17',
-    'dmsp17': 'DMSP-17',
-    'DMSP-18': 'DMSP-18',
-    'dmsp18': 'DMSP-18',
-    'DMSP-16': 'DMSP-16',
-    'dmsp16': 'DMSP-16',
-    'NOAA-19': 'NOAA-19',
-    'n19': 'NOAA-19',
-    'NOAA-20': 'NOAA-20',
-    'n20': 'NOAA-20',
-    'NOAA-21': 'NOAA-21',
-    'n21': 'NOAA-21'
-}
-
-# Create reverse mapping (canonical to variants)
-CANONICAL_TO_VARIANTS = {}
-for variant, canonical in SATELLITE_ID_MAPPINGS.items():
-    if canonical not in CANONICAL_TO_VARIANTS:
-        CANONICAL_TO_VARIANTS[canonical] = []
-    CANONICAL_TO_VARIANTS[canonical].append(variant)
-
-def get_canonical_id(satellite_id):
-    """Get canonical ID for a satellite ID variant"""
-    return SATELLITE_ID_MAPPINGS.get(satellite_id, satellite_id)
+# Path to your prebuilt relationships file, next to this module
+RELATIONSHIPS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "satellite_relationships.json")
 
-def get_all_variants(canonical_id):
-    """Get all variants for a canonical satellite ID"""
-    return CANONICAL_TO_VARIANTS.get(canonical_id, [canonical_id])
-
-def consolidate_satellite_data(original_data):
+@functools.lru_cache(maxsize=4)
+def _load_stored_satellite_ids(mtime_ns, size):
     """
-    Consolidate satellite data using the hard-coded mapping
+    Read the satellite IDs stored in the database from the relationships file.
+    Cached per (mtime, size) of the file, so it is only re-read after the file changes.
     """
-    if not original_data:
-        return None
-        
-    normalized_data = {
-        "satellites": [],
-        "coverages": original_data.get("coverages", []),
-        "instruments": original_data.get("instruments", []),
-        "relationships": {},
-        "satellite_variants": {}  # Maps canonical IDs to their variants
-    }
+    if orjson is not None:
+        with open(RELATIONSHIPS_FILE, 'rb') as f:
+            relationships = orjson.loads(f.read())
+    else:
+        with open(RELATIONSHIPS_FILE, 'r') as f:
+            relationships = json.load(f)
     
-    # Group satellites by canonical ID
-    satellite_groups = {}
+    # generate_relationship lists the raw spellings under satellite_variants,
+    # older files list them as the satellites
+    stored_ids = set(relationships.get("satellites", []))
+    for variants in relationships.get("satellite_variants", {}).values():
+        stored_ids.update(variants)
+    return frozenset(stored_ids)
+
+def get_stored_satellite_ids():
+    """
+    Get the satellite IDs as stored in the database, empty if the relationships
+    file can't be read.
+    """
+    try:
+        st = os.stat(RELATIONSHIPS_FILE)
+        return _load_stored_satellite_ids(st.st_mtime_ns, st.st_size)
+    except Exception as e:
+        logger.warning(f"Could not read stored satellite IDs from {RELATIONSHIPS_FILE}: {str(e)}")
+        return frozenset()
+
+def datetime_columns_to_iso(data):
+    """
+    Format the datetime and date columns of a Polars DataFrame as ISO 8601 strings,
+    inside Polars rather than per value in Python.
     
-    for sat_id in original_data.get("satellites", []):
-        canonical_id = get_canonical_id(sat_id)
-        
-        if canonical_id not in satellite_groups:
-            satellite_groups[canonical_id] = []
+    Args:
+        data (pl.DataFrame): Query result
         
-        satellite_groups[canonical_id].append(sat_id)
-    
-    # Use canonical IDs as the satellite list
-    normalized_data["satellites"] = sorted(satellite_groups.keys())
+    Returns:
+        pl.DataFrame: The data with its datetime/date columns as strings
+    """
+    conversions = []
+    for name, dtype in data.schema.items():
+        if dtype == pl.Datetime:
+            # Same layout as datetime.isoformat(), always with microseconds;
+            # keep the UTC offset so the browser doesn't read it as local time
+            fmt = "%Y-%m-%dT%H:%M:%S%.6f%:z" if dtype.time_zone else "%Y-%m-%dT%H:%M:%S%.6f"
+        elif dtype == pl.Date:
+            fmt = "%Y-%m-%d"
+        else:
+            continue
+        conversions.append(pl.col(name).dt.strftime(fmt))
     
-    # Store variant mapping
-    normalized_data["satellite_variants"] = satellite_groups
+    return data.with_columns(conversions) if conversions else data
+
+def split_filter_values(value):
+    """
+    Convert a filter value to a list if it's a (comma-separated) string
     
-    # Merge relationships for each canonical ID
-    for canonical_id, variants in satellite_groups.items():
-        normalized_data["relationships"][canonical_id] = {
-            "coverages": [],
-            "instruments": [],
-            "coverage_instruments": {}
-        }
-        
-        # Merge relationship data from all variants
-        for variant_id in variants:
-            if variant_id not in original_data.get("relationships", {}):
-                continue
-                
-            original_relationship = original_data["relationships"][variant_id]
-            
-            # Merge coverages
-            for coverage in original_relationship.get("coverages", []):
-                if coverage not in normalized_data["relationships"][canonical_id]["coverages"]:
-                    normalized_data["relationships"][canonical_id]["coverages"].append(coverage)
-            
-            # Merge instruments
-            for instrument in original_relationship.get("instruments", []):
-                if instrument not in normalized_data["relationships"][canonical_id]["instruments"]:
-                    normalized_data["relationships"][canonical_id]["instruments"].append(instrument)
-            
-            # Merge coverage_instruments
-            for coverage, instruments in original_relationship.get("coverage_instruments", {}).items():
-                if coverage not in normalized_data["relationships"][canonical_id]["coverage_instruments"]:
-                    normalized_data["relationships"][canonical_id]["coverage_instruments"][coverage] = []
-                
-                for instrument in instruments:
-                    if instrument not in normalized_data["relationships"][canonical_id]["coverage_instruments"][coverage]:
-                        normalized_data["relationships"][canonical_id]["coverage_instruments"][coverage].append(instrument)
-        
-        # Sort arrays for consistent output
-        normalized_data["relationships"][canonical_id]["coverages"].sort()
-        normalized_data["relationships"][canonical_id]["instruments"].sort()
+    Args:
+        value: A string, or an already split list of values (or None)
         
-        for coverage in normalized_data["relationships"][canonical_id]["coverage_instruments"]:
-            normalized_data["relationships"][canonical_id]["coverage_instruments"][coverage].sort()
-    
-    return normalized_data
+    Returns:
+        list: The filter values, non-string values are returned unchanged
+    """
+    if isinstance(value, str):
+        if ',' in value:
+            return [v.strip() for v in value.split(',')]
+        return [value]
+    return value  # Already a list or None
 
-def load_relationship_data():
+def _parse_iso(value):
     """
-    Load prebuilt satellite relationship data from JSON file and consolidate duplicates.
+    Convert an ISO format string (a trailing 'Z' is accepted) to a datetime,
+    datetimes are passed through. Naive values are assumed to be UTC.
     """
-    try:
-        if os.path.exists(RELATIONSHIPS_FILE):
-            with open(RELATIONSHIPS_FILE, 'r') as f:
-                relationships = json.load(f)
-                
-            # Consolidate satellite data to merge variants
-            consolidated = consolidate_satellite_data(relationships)
-            
-            if consolidated:
-                logger.info(f"Loaded and consolidated {len(consolidated['satellites'])} unique satellites from relationships")
-                return consolidated
-            else:
-                logger.warning("Failed to consolidate relationships data")
-                return relationships
-        else:
-            logger.warning(f"Relationships file not found: {RELATIONSHIPS_FILE}")
-            return None
-    except Exception as e:
-        logger.error(f"Error loading relationship data: {str(e)}")
-        return None
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+# Recent query results, keyed by the query. Only helps long-lived processes
+# (e.g. data.py served over WSGI), where polling clients repeat the same query
+# within seconds. Entries are kept in insertion order, oldest first
+QUERY_CACHE_TTL = 15  # seconds
+QUERY_CACHE_SIZE = 64
+_QUERY_CACHE = OrderedDict()
+_QUERY_CACHE_LOCK = threading.Lock()
+
+def _filter_key(values):
+    """Hashable, order-independent form of a filter list (None means no filter)"""
+    return None if values is None else tuple(sorted(values))
+
+def cached_satellite_data(start_datetime, end_datetime, satellite_ids=None, coverage=None, instrument=None):
+    """
+    Call satellite_data_from_filters, reusing the result of an identical query
+    made less than QUERY_CACHE_TTL seconds ago.
+    
+    Returns:
+        pl.DataFrame: The query result
+    """
+    key = (start_datetime, end_datetime, _filter_key(satellite_ids), _filter_key(coverage), _filter_key(instrument))
+    now = time.monotonic()
+    
+    with _QUERY_CACHE_LOCK:
+        cached = _QUERY_CACHE.get(key)
+    if cached is not None and cached[0] > now:
+        logger.info("Using cached query result")
+        return cached[1]
+    
+    data = satellite_data_from_filters(
+        SATELLITE_DATA_DIR,
+        start_date=start_datetime,
+        end_date=end_datetime,
+        satellite_ids=satellite_ids,
+        coverages=coverage,
+        instruments=instrument
+    )
+    
+    with _QUERY_CACHE_LOCK:
+        _QUERY_CACHE[key] = (now + QUERY_CACHE_TTL, data)
+        _QUERY_CACHE.move_to_end(key)
+        # Drop expired entries, then the oldest ones beyond the size limit
+        while _QUERY_CACHE and (len(_QUERY_CACHE) > QUERY_CACHE_SIZE
+                                or next(iter(_QUERY_CACHE.values()))[0] <= now):
+            _QUERY_CACHE.popitem(last=False)
+    
+    return data
 
 def run_sat_latency_query(start_time, end_time, filters=None):
     """
@@ -172,26 +167,13 @@ def run_sat_latency_query(start_time, end_time, filters=None):
         list: List of latency records as dictionaries
     """
     try:
-        logger.info(f"Querying satellite latency data from {start_time} to {end_time}")
-        
-        # Convert string ISO timestamps to datetime objects if they are strings
-        if isinstance(start_time, str):
-            start_datetime = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-        else:
-            start_datetime = start_time
-            
-        if isinstance(end_time, str):
-            end_datetime = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-        else:
-            end_datetime = end_time
+        logger.info("Querying satellite latency data from %s to %s", start_time, end_time)
         
-        # Ensure timezone is set
-        if start_datetime.tzinfo is None:
-            start_datetime = start_datetime.replace(tzinfo=timezone.utc)
-        if end_datetime.tzinfo is None:
-            end_datetime = end_datetime.replace(tzinfo=timezone.utc)
+        # Convert string ISO timestamps to timezone-aware datetime objects
+        start_datetime = _parse_iso(start_time)
+        end_datetime = _parse_iso(end_time)
             
-        logger.info(f"Converted timestamps: {start_datetime} to {end_datetime}")
+        logger.info("Converted timestamps: %s to %s", start_datetime, end_datetime)
         
        # Initialize filter parameters for the sat_latency API
         satellite_ids = None
@@ -200,107 +182,69 @@ def run_sat_latency_query(start_time, end_time, filters=None):
 
         # Process filters
         if filters:
-            # Expand satellite IDs to include all variants
+            # Expand satellite IDs to include all variants, including the stored
+            # spellings they are grouped with; the set drops duplicates
             if "satellite-id" in filters:
-                satellite_id = filters["satellite-id"]
-                        
-                # Handle list or comma-separated list of satellites
-                if isinstance(satellite_id, list):
-                    expanded_ids = []
-                    for sat_id in satellite_id:
-                        canonical_id = get_canonical_id(sat_id)
-                        expanded_ids.extend(get_all_variants(canonical_id))
-                    # Remove duplicates
-                    satellite_ids = list(set(expanded_ids))
-                elif isinstance(satellite_id, str) and ',' in satellite_id:
-                    satellite_ids_list = [s.strip() for s in satellite_id.split(',')]
-                    expanded_ids = []
-                    for sat_id in satellite_ids_list:
-                        canonical_id = get_canonical_id(sat_id)
-                        expanded_ids.extend(get_all_variants(canonical_id))
-                    satellite_ids = list(set(expanded_ids))
-                elif isinstance(satellite_id, str):
-                    canonical_id = get_canonical_id(satellite_id)
-                    satellite_ids = get_all_variants(canonical_id)
+                satellite_id_list = split_filter_values(filters["satellite-id"])
+                if isinstance(satellite_id_list, (list, tuple)):
+                    stored_ids = get_stored_satellite_ids()
+                    satellite_ids = list({
+                        variant
+                        for sat_id in satellite_id_list
+                        for variant in get_all_variants(sat_id, stored_ids)
+                    })
                 
             # Get coverage filter
             if "coverage" in filters:
-                coverage_value = filters["coverage"]
-                # Convert coverage to a list if it's a string
-                if isinstance(coverage_value, str):
-                    if ',' in coverage_value:
-                        coverage = [c.strip() for c in coverage_value.split(',')]
-                    else:
-                        coverage = [coverage_value]
-                else:
-                    coverage = coverage_value  # Already a list or None
+                coverage = split_filter_values(filters["coverage"])
                 
             # Get instrument filter
             if "instrument" in filters:
-                instrument_value = filters["instrument"]
-                # Convert instrument to a list if it's a string
-                if isinstance(instrument_value, str):
-                    if ',' in instrument_value:
-                        instrument = [i.strip() for i in instrument_value.split(',')]
-                    else:
-                        instrument = [instrument_value]
-                else:
-                    instrument = instrument_value  # Already a list or None
+                instrument = split_filter_values(filters["instrument"])
 
         # Log the query parameters
-        logger.info(f"Query parameters: database={SATELLITE_DATA_DIR}, start_date={start_datetime}, end_date={end_datetime}")
-        logger.info(f"Filters: satellite_ids={satellite_ids}, coverage={coverage}, instrument={instrument}")
+        logger.info("Query parameters: database=%s, start_date=%s, end_date=%s", SATELLITE_DATA_DIR, start_datetime, end_datetime)
+        logger.info("Filters: satellite_ids=%s, coverage=%s, instrument=%s", satellite_ids, coverage, instrument)
 
-        # Call the sat_latency.interface function
-        data = satellite_data_from_filters(
-            SATELLITE_DATA_DIR,
-            start_date=start_datetime,
-            end_date=end_datetime,
-            satellite_ids=satellite_ids,
-            coverages=coverage,
-            instruments=instrument
-        )
+        # Call the sat_latency.interface function (through the short-lived cache)
+        data = cached_satellite_data(start_datetime, end_datetime, satellite_ids, coverage, instrument)
         # Convert result to a list of dictionaries for JSON serialization
         if data is not None:
             try:
-                # Convert Polars DataFrame to list of dictionaries
-                records = data.to_dicts()
-                
-                # Process datetime objects for JSON serialization
-                processed_records = []
-                for record in records:
-                    processed_record = {}
-                    for key, value in record.items():
-                        if isinstance(value, (datetime, pd.Timestamp)):
-                            processed_record[key] = value.isoformat()
-                        else:
-                            processed_record[key] = value
-                    processed_records.append(processed_record)
+                # Convert datetimes to strings for JSON serialization, then
+                # the Polars DataFrame to list of dictionaries
+                records = datetime_columns_to_iso(data).to_dicts()
                 
-                logger.info(f"Successfully converted data: {len(processed_records)} records found")
-                return processed_records
+                logger.info("Successfully converted data: %d records found", len(records))
+                return records
                 
             except Exception as e:
-                logger.error(f"Error converting Polars DataFrame to dict: {str(e)}")
-                # Fallback method if to_dicts() is not available
+                logger.error("Error converting Polars DataFrame to dict: %s", e)
+                # Fallback: non-strict casts of the datetime columns to strings, in Polars.
+                # Values that can't be cast become nulls instead of failing the query
                 try:
-                    pandas_df = data.to_pandas()
-                    
-                    # Convert datetime columns to strings
-                    for col in pandas_df.select_dtypes(include=['datetime64']).columns:
-                        pandas_df[col] = pandas_df[col].astype(str)
-                    
-                    records = pandas_df.to_dict(orient='records')
-                    logger.info(f"Successfully converted data via pandas: {len(records)} records found")
+                    temporal_names = [
+                        name for name, dtype in data.schema.items()
+                        if dtype == pl.Datetime or dtype == pl.Date
+                    ]
+                    converted = data.with_columns([
+                        pl.col(name).cast(pl.Utf8, strict=False) for name in temporal_names
+                    ])
+                    for name in temporal_names:
+                        lost = converted[name].null_count() - data[name].null_count()
+                        if lost:
+                            logger.warning("Cast fallback nulled %d values of column %s", lost, name)
+                    records = converted.to_dicts()
+                    logger.info("Successfully converted data via cast fallback: %d records found", len(records))
                     return records
                 except Exception as e2:
-                    logger.error(f"Error in pandas conversion fallback: {str(e2)}")
+                    logger.error("Error in cast conversion fallback: %s", e2)
                     return []
         else:
             logger.warning("Query returned None")
             return []
     except Exception as e:
-        logger.error(f"Error executing satellite latency query: {str(e)}")
+        logger.error("Error executing satellite latency query: %s", e)
         import traceback
         logger.error(traceback.format_exc())
         return []
\ No newline at end of file
@@ -0,0 +1,83 @@
+"""
+Satellite ID variations and their canonical IDs, shared by the CGI scripts,
+sat_db_functions and generate_relationship so they all group satellites alike.
+"""
+from collections import defaultdict
+
+# Hard-coded mapping of satellite ID variations to canonical IDs
+# This makes it easy for future developers to add or modify mappings
+SATELLITE_ID_MAPPINGS = {
+    # Format: 'variant': 'canonical'
+    'G16': 'G16',
+    'g16': 'G16',
+    'G18': 'G18',
+    'g18': 'G18',
+    'G19': 'G19',
+    'g19': 'G19',
+    'DMSP-17': 'DMSP-17',
+    'dmsp17': 'DMSP-17',
+    'DMSP-18': 'DMSP-18',
+    'dmsp18': 'DMSP-18',
+    'DMSP-16': 'DMSP-16',
+    'dmsp16': 'DMSP-16',
+    'NOAA-19': 'NOAA-19',
+    'n19': 'NOAA-19',
+    'NOAA-20': 'NOAA-20',
+    'n20': 'NOAA-20',
+    'NOAA-21': 'NOAA-21',
+    'n21': 'NOAA-21',
+    'NOAA-18': 'NOAA-18',
+    'n18': 'NOAA-18',
+    'NOAA-15': 'NOAA-15',
+    'n15': 'NOAA-15',
+    # Add more mappings as needed
+}
+
+# Lookup table keyed by normalized IDs (lower case, no '-' or spaces), so
+# spellings not listed above (e.g. 'N19', 'G-16', ' g16 ') still resolve.
+# The mapping above keeps the exact spellings stored in the database
+def normalize_satellite_id(satellite_id):
+    """Normalize a satellite ID for lookups in NORMALIZED_MAP"""
+    return satellite_id.lower().replace('-', '').replace(' ', '')
+
+NORMALIZED_MAP = {normalize_satellite_id(variant): canonical for variant, canonical in SATELLITE_ID_MAPPINGS.items()}
+
+def get_canonical_id(satellite_id):
+    """Get canonical ID for a satellite ID variant (ignoring case, '-' and spaces)"""
+    if isinstance(satellite_id, str):
+        return NORMALIZED_MAP.get(normalize_satellite_id(satellite_id), satellite_id)
+    return satellite_id
+
+# Create reverse mapping (canonical to variants), frozen into tuples once built
+_canonical_to_variants = defaultdict(list)
+for variant, canonical in SATELLITE_ID_MAPPINGS.items():
+    _canonical_to_variants[canonical].append(variant)
+CANONICAL_TO_VARIANTS = {canonical: tuple(variants) for canonical, variants in _canonical_to_variants.items()}
+
+def get_all_variants(satellite_id, stored_ids=()):
+    """
+    Get every spelling of a satellite ID to query the database with, as a tuple.
+    
+    get_canonical_id groups spellings that aren't listed in SATELLITE_ID_MAPPINGS
+    (e.g. 'N19' under 'NOAA-19'), so the listed variants alone would miss the rows
+    stored under them. The stored IDs that resolve to the same satellite are added.
+    
+    Args:
+        satellite_id: Satellite ID as given by the caller, always part of the result
+        stored_ids: Satellite IDs as stored in the database
+        
+    Returns:
+        tuple: The caller's ID, the listed variants of its canonical ID and the
+        matching stored IDs, without duplicates
+    """
+    canonical_id = get_canonical_id(satellite_id)
+    variants = dict.fromkeys((satellite_id, canonical_id))
+    variants.update(dict.fromkeys(CANONICAL_TO_VARIANTS.get(canonical_id, ())))
+    if isinstance(satellite_id, str):
+        key = normalize_satellite_id(satellite_id)
+        for stored_id in stored_ids:
+            if isinstance(stored_id, str) and (
+                get_canonical_id(stored_id) == canonical_id or normalize_satellite_id(stored_id) == key
+            ):
+                variants[stored_id] = None
+    return tuple(variants)
@@ -1,67 +1,43 @@
 #!/home/oper/py39env/bin/python
-import cgi
 import json
 import sys
 import os
+from collections import defaultdict
 
-# Print headers
-print("Content-Type: application/json")
-print()  # Empty line after headers
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard library json
+    orjson = None
 
 # Get script directory
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Satellite ID mappings
-SATELLITE_ID_MAPPINGS = {
-    'G16': 'G16', 'g16': 'G16',
-    'G18': 'G18', 'g18': 'G18',
-    'G19': 'G19', 'g19': 'G19',
-    'DMSP-17': 'DMSP-17', 'dmsp17': 'DMSP-17',
-    'DMSP-18': 'DMSP-18', 'dmsp18': 'DMSP-18',
-    'DMSP-16': 'DMSP-16', 'dmsp16': 'DMSP-16',
-    'NOAA-19': 'NOAA-19', 'n19': 'NOAA-19',
-    'NOAA-20': 'NOAA-20', 'n20': 'NOAA-20',
-    'NOAA-21': 'NOAA-21', 'n21': 'NOAA-21'
-}
+# The shared satellite ID mappings live next to this script, which isn't on
+# the path when it is loaded by a WSGI server
+if script_dir not in sys.path:
+    sys.path.append(script_dir)
+import satellite_ids
+from satellite_ids import get_canonical_id
 
-try:
-    # Get query parameters
-    form = cgi.FieldStorage()
-    date_str = form.getvalue("date")
-    
-    # Define the path to the relationships file
-    relationships_file = os.path.join(script_dir, "satellite_relationships.json")
-    
-    # Check if file exists
-    if not os.path.exists(relationships_file):
-        print(json.dumps({
-            "error": f"Relationships file not found: {relationships_file}",
-            "satellites": [],
-            "baseDir": "/data/sat_latency"
-        }))
-        sys.exit(0)
-    
-    # Load the relationships data
-    with open(relationships_file, 'r') as f:
-        raw_relationships = json.load(f)
-    
+# Define the path to the relationships file
+RELATIONSHIPS_FILE = os.path.join(script_dir, "satellite_relationships.json")
+BASE_DIR = "/data/sat_latency"
+
+def build_satellite_list(raw_relationships):
+    """Group the satellites of the relationships data under their canonical IDs"""
     # Group satellites by canonical ID
-    satellite_groups = {}
+    satellite_groups = defaultdict(list)
     for sat_id in raw_relationships.get("satellites", []):
-        canonical_id = SATELLITE_ID_MAPPINGS.get(sat_id, sat_id)
-        
-        if canonical_id not in satellite_groups:
-            satellite_groups[canonical_id] = []
-        
-        satellite_groups[canonical_id].append(sat_id)
+        satellite_groups[get_canonical_id(sat_id)].append(sat_id)
     
     # Create the normalized list of satellites
     satellites = []
     for canonical_id, variants in satellite_groups.items():
         # Create display name with variants
+        # (only variants that appear in the data, so this can't come from the mapping alone)
         display_name = canonical_id
         if len(variants) > 1:
-            variant_str = ", ".join([v for v in variants if v != canonical_id])
+            variant_str = ", ".join(v for v in variants if v != canonical_id)
             if variant_str:
                 display_name = f"{canonical_id} ({variant_str})"
         
@@ -73,19 +49,88 @@ try:
     
     # Sort the satellites by ID
     satellites.sort(key=lambda x: x["id"])
+    return satellites
+
+def dumps_json(obj):
+    """Serialize obj to JSON bytes, using orjson when it is available"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+# The response only depends on the relationships file (the "date" parameter
+# is not used), so long-lived handlers keep the encoded body until the file,
+# this script or the satellite ID mappings change. Each file is identified by
+# its (mtime, size), so a file replaced with an older mtime is noticed too
+_CACHE = {"key": None, "body": b""}
+
+def get_response_body():
+    """Get the satellites response as JSON bytes, rebuilt only when the files changed"""
+    try:
+        source_key = tuple(
+            (st.st_mtime_ns, st.st_size)
+            for st in map(os.stat, (RELATIONSHIPS_FILE, __file__, satellite_ids.__file__))
+        )
+    except FileNotFoundError:
+        # Check if file exists
+        return dumps_json({
+            "error": f"Relationships file not found: {RELATIONSHIPS_FILE}",
+            "satellites": [],
+            "baseDir": BASE_DIR
+        })
+    
+    if _CACHE["key"] != source_key:
+        # Load the relationships data
+        if orjson is not None:
+            with open(RELATIONSHIPS_FILE, 'rb') as f:
+                raw_relationships = orjson.loads(f.read())
+        else:
+            with open(RELATIONSHIPS_FILE, 'r') as f:
+                raw_relationships = json.load(f)
+        
+        _CACHE["body"] = dumps_json({
+            "satellites": build_satellite_list(raw_relationships),
+            "baseDir": BASE_DIR,
+            "normalized": True  # Flag to indicate normalization was performed
+        })
+        _CACHE["key"] = source_key
     
-    # Return the response
-    print(json.dumps({
-        "satellites": satellites,
-        "baseDir": "/data/sat_latency",
-        "normalized": True  # Flag to indicate normalization was performed
-    }))
+    return _CACHE["body"]
 
-except Exception as e:
-    import traceback
-    print(json.dumps({
-        "error": str(e),
-        "traceback": traceback.format_exc(),
-        "satellites": [],
-        "baseDir": "/data/sat_latency"
-    }))
\ No newline at end of file
+def get_response():
+    """Get the response body, reporting any error in the JSON body"""
+    try:
+        return get_response_body()
+    except Exception as e:
+        import traceback
+        return dumps_json({
+            "error": str(e),
+            "traceback": traceback.format_exc(),
+            "satellites": [],
+            "baseDir": BASE_DIR
+        })
+
+def application(environ, start_response):
+    """
+    WSGI entry point, so the parsed response can be served from memory by a
+    long-lived process (e.g. Apache mod_wsgi) instead of a new CGI process
+    re-reading the relationships file for every request.
+    """
+    body = get_response()
+    start_response("200 OK", [
+        ("Content-Type", "application/json"),
+        ("Content-Length", str(len(body)))
+    ])
+    return [body]
+
+# Main entry point for CGI
+if __name__ == "__main__":
+    body = get_response()
+    
+    # Write the headers and the already encoded body straight to the byte
+    # stream; Content-Length lets the web server keep the connection alive
+    try:
+        sys.stdout.buffer.write(b"Content-Type: application/json\r\nContent-Length: %d\r\n\r\n" % len(body))
+        sys.stdout.buffer.write(body)
+        sys.stdout.buffer.flush()
+    except BrokenPipeError:
+        pass  # The client disconnected, nothing left to do
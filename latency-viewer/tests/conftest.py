@@ -0,0 +1,10 @@
+"""tests.conftest
+
+The viewer's Python code is a set of scripts served from assets/python,
+make them importable as top-level modules.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "assets", "python"))
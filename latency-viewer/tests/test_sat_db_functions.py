@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+pytest.importorskip("polars")
+pytest.importorskip("sat_latency.interface")
+
+import sat_db_functions  # noqa: E402
+
+
+@pytest.fixture
+def queried_ids(monkeypatch, tmp_path):
+    """Record the satellite IDs run_sat_latency_query filters on."""
+    relationships = tmp_path / "satellite_relationships.json"
+    relationships.write_text(json.dumps({"satellites": ["N19", "n19", "NOAA-19", "G16"]}))
+    monkeypatch.setattr(sat_db_functions, "RELATIONSHIPS_FILE", str(relationships))
+
+    queried = []
+
+    def fake_query(start, end, satellite_ids, coverage, instrument):
+        queried.append(set(satellite_ids))
+
+    monkeypatch.setattr(sat_db_functions, "cached_satellite_data", fake_query)
+    return queried
+
+
+def test_query_includes_stored_unlisted_spelling(queried_ids):
+    """Selecting the canonical ID also fetches rows stored under an unlisted spelling."""
+    sat_db_functions.run_sat_latency_query(
+        "2025-01-01T00:00:00", "2025-01-01T23:59:59", {"satellite-id": ["NOAA-19"]}
+    )
+    assert queried_ids == [{"NOAA-19", "n19", "N19"}]
+
+
+def test_query_keeps_caller_id(queried_ids):
+    """The caller's own spelling is always part of the filter."""
+    sat_db_functions.run_sat_latency_query(
+        "2025-01-01T00:00:00", "2025-01-01T23:59:59", {"satellite-id": ["noaa 19"]}
+    )
+    assert queried_ids == [{"noaa 19", "NOAA-19", "n19", "N19"}]
@@ -0,0 +1,35 @@
+from satellite_ids import get_all_variants, get_canonical_id
+
+
+def test_canonical_id_ignores_case_and_separators():
+    """Spellings that aren't listed resolve like the listed ones."""
+    assert get_canonical_id("N19") == "NOAA-19"
+    assert get_canonical_id(" G-16 ") == "G16"
+
+
+def test_canonical_id_unknown():
+    """IDs without a mapping keep their original value."""
+    assert get_canonical_id("composite") == "composite"
+    assert get_canonical_id(None) is None
+
+
+def test_all_variants_listed():
+    """The listed variants of the canonical ID are included."""
+    assert set(get_all_variants("NOAA-19")) == {"NOAA-19", "n19"}
+
+
+def test_all_variants_keeps_caller_id():
+    """An unlisted spelling given by the caller is queried too."""
+    assert set(get_all_variants("N19")) == {"N19", "NOAA-19", "n19"}
+
+
+def test_all_variants_stored_unlisted_spelling():
+    """Stored spellings grouped under the canonical ID are included."""
+    stored = ["N19", "n19", "NOAA-19", "G16", "n20"]
+    assert set(get_all_variants("NOAA-19", stored)) == {"NOAA-19", "n19", "N19"}
+
+
+def test_all_variants_stored_unknown_id():
+    """Stored IDs without a mapping are matched by their normalized form."""
+    stored = ["X-1", "x1", "x2"]
+    assert set(get_all_variants("X1", stored)) == {"X1", "X-1", "x1"}
@@ -7,8 +7,10 @@ CLI for quickmq.
 import argparse
 import json
 import logging
+import os
+import re
 import sys
-from typing import TYPE_CHECKING, List, Mapping, Optional, Tuple
+from typing import TYPE_CHECKING, Callable, Iterator, List, Mapping, Optional, Tuple, Union
 
 from ssec_amqp import AmqpClient, AmqpConnection, ClusteredConnection, ConnectionStatus
 from ssec_amqp.__about__ import __version__
@@ -18,13 +20,26 @@ if TYPE_CHECKING:
     # Not available in py36
     from typing import Any
 
+json_loads: "Callable[[Union[str, bytes]], Any]"
+try:
+    # Faster parsing of the stdin messages, if available
+    import orjson  # type: ignore[import-not-found,unused-ignore]
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+
+# key=value, split at the first '='; neither side may be empty
+_KEY_VALUE_RE = re.compile(r"\A([^=]+)=(.+)\Z", re.DOTALL)
+
 
 def key_value_type(val: str) -> Tuple[str, str]:
     """Turn CLI arg key=value into tuple (key, value)."""
-    key, eq, val = val.partition("=")
-    if not eq or not val:
+    match = _KEY_VALUE_RE.match(val)
+    if match is None:
         raise ValueError
-    return (key, val)
+    return (match.group(1), match.group(2))
 
 
 def parse_args() -> argparse.Namespace:
@@ -162,15 +177,43 @@ def client_from_uris(
     return cl
 
 
+def topic_formatter(topic_fmt: str) -> Callable[[Mapping[str, "Any"]], str]:
+    """Create a function that makes a topic from message data, given a format string.
+
+    If ``topic_fmt`` doesn't contain any '{}' pairs, the function always returns the topic.
+    """
+    if "{" not in topic_fmt:
+        # straight up topic, no formatting
+        return lambda _data: topic_fmt
+    return topic_fmt.format_map
+
+
 def hydrate_topic(topic_fmt: str, data: Mapping[str, "Any"]) -> str:
     """Create a topic given a format string and message data.
 
     If ``topic_fmt`` doesn't contain any '{}' pairs, returns the topic.
     """
-    if "{" not in topic_fmt:
-        # straight up topic, no formatting
-        return topic_fmt
-    return topic_fmt.format_map(data)
+    return topic_formatter(topic_fmt)(data)
+
+
+def iter_line_batches(fd: int, read_size: int = 64 * 1024) -> Iterator[List[bytes]]:
+    """Yield the complete lines read from file descriptor ``fd``, in batches.
+
+    A batch holds every line that arrived with a single read, so bursts of lines are
+    handled together while a lone line is still yielded as soon as it arrives.
+    A trailing line without a newline is yielded at EOF.
+    """
+    partial = b""
+    while True:
+        chunk = os.read(fd, read_size)
+        if not chunk:
+            break
+        lines = (partial + chunk).split(b"\n")
+        partial = lines.pop()
+        if lines:
+            yield lines
+    if partial:
+        yield [partial]
 
 
 def main() -> Optional[int]:
@@ -193,11 +236,14 @@ def main() -> Optional[int]:
         )
         return 1
 
+    # The topic format is fixed, only decide how to apply it once
+    make_topic = topic_formatter(args.topic)
+
     if args.data:
         # Quick publish
         data = args.data
         data.update(args.metadata)
-        topic = hydrate_topic(args.topic, data)
+        topic = make_topic(data)
 
         pub_status = client.publish(data, route_key=topic, exchange=args.exchange)
 
@@ -205,17 +251,30 @@ def main() -> Optional[int]:
         ret_status = all(st in (DeliveryStatus.REJECTED, DeliveryStatus.DROPPED) for st in pub_status)
         return int(ret_status)
 
+    metadata = dict(args.metadata)
+
     try:
-        for line in iter(sys.stdin.readline, ""):
-            data = json.loads(line.strip())
-            data.update(args.metadata)
-            try:
-                topic = hydrate_topic(args.topic, data)
-            except KeyError:
-                logging.warning("Couldn't create topic with format %s and data %s", args.topic, data)
-                continue
-            stats = client.publish(data, route_key=topic, exchange=args.exchange)
-            logging.info("Published to topic %s with status %s", topic, stats)
+        for lines in iter_line_batches(sys.stdin.fileno()):
+            published = undelivered = 0
+            for line in lines:
+                if not line or line.isspace():
+                    # Skip blank lines without copying each line to strip it
+                    continue
+                # Parse the raw bytes, no need to decode (or strip) each line first
+                data = json_loads(line)
+                data.update(metadata)
+                try:
+                    topic = make_topic(data)
+                except KeyError:
+                    logging.warning("Couldn't create topic with format %s and data %s", args.topic, data)
+                    continue
+                stats = client.publish(data, route_key=topic, exchange=args.exchange)
+                logging.debug("Published to topic %s with status %s", topic, stats)
+                published += 1
+                if all(st in (DeliveryStatus.REJECTED, DeliveryStatus.DROPPED) for st in stats.values()):
+                    undelivered += 1
+            # One summary per batch instead of a log record per message
+            logging.info("Published %d message(s), %d not delivered anywhere", published, undelivered)
     except KeyboardInterrupt:
         logging.info("Got interrupt, ta ta for now")
         return 0
@@ -3,6 +3,8 @@
 Unit tests for ``ssec_amqp.main``.
 """
 
+import os
+
 import pytest
 import ssec_amqp.main as cli
 
@@ -23,6 +25,11 @@ def test_metadata_type():
     with pytest.raises(ValueError):  # noqa: PT011
         cli.key_value_type("key")
 
+    with pytest.raises(ValueError):  # noqa: PT011
+        cli.key_value_type("=val")
+
+    assert cli.key_value_type("url=a=b") == ("url", "a=b")
+
 
 def test_client_creation():
     """Ensure ``client_from_uris`` connects to both clusters and individual hosts."""
@@ -51,3 +58,39 @@ def test_hydrate_topic():
     assert cli.hydrate_topic("{test[two]}.one.two.three", {"test": {"two": "val"}}) == "val.one.two.three"
 
     assert cli.hydrate_topic("one.two.three", {"test": "val"}) == "one.two.three"
+
+
+def test_topic_formatter():
+    """Topic function formats the data, or returns static topics as is."""
+
+    make_topic = cli.topic_formatter("{test}.one")
+    assert make_topic({"test": "val"}) == "val.one"
+    assert make_topic({"test": "other"}) == "other.one"
+
+    with pytest.raises(KeyError):
+        make_topic({})
+
+    assert cli.topic_formatter("one.two.three")({}) == "one.two.three"
+
+
+def test_iter_line_batches():
+    """Lines are batched per read, partial lines are carried over to the next read."""
+
+    read_fd, write_fd = os.pipe()
+    try:
+        batches = cli.iter_line_batches(read_fd)
+
+        os.write(write_fd, b'{"a": 1}\n{"b": 2}\n{"c"')
+        assert next(batches) == [b'{"a": 1}', b'{"b": 2}']
+
+        os.write(write_fd, b": 3}\n")
+        assert next(batches) == [b'{"c": 3}']
+
+        os.write(write_fd, b'{"d": 4}')
+        os.close(write_fd)
+        write_fd = -1
+        assert list(batches) == [[b'{"d": 4}']]
+    finally:
+        os.close(read_fd)
+        if write_fd != -1:
+            os.close(write_fd)
@@ -40,19 +40,28 @@ __docformat__ = 'reStructuredText'
 import os, sys, re, socket, time
 import logging, unittest, optparse, json
 import traceback
+import ast
 from functools import reduce
 from datetime import datetime, timedelta
 from signal import alarm, SIGALRM, signal, SIGTERM
 from random import shuffle
 from functools import partial
+from heapq import heappush, heappop
+from itertools import count, repeat
 from collections import defaultdict, namedtuple
 import multiprocessing as mp
+try:  # only needed for type comments
+    from typing import Set
+except ImportError:
+    pass
 
 PY_MAJOR_VERSION = sys.version_info[0]
 if PY_MAJOR_VERSION == 2:
     import Queue
+    import __builtin__ as builtins
 else:
     import queue as Queue  # py3
+    import builtins
 
 try:
     import pika
@@ -70,6 +79,21 @@ except AttributeError:
     PIKA_MAJOR_VERSION = -1
 PIKA_MAJOR_VERSION = int(PIKA_MAJOR_VERSION)
 
+try:  # faster JSON for the per-message paths, working directly on bytes
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    json_loads_bytes = orjson.loads
+    json_dumps_bytes = orjson.dumps
+else:
+    def json_loads_bytes(data):
+        return json.loads(data.decode('utf-8'))
+
+    def json_dumps_bytes(obj):
+        return json.dumps(obj).encode('utf-8')
+
 LOG = logging.getLogger(__name__)
 
 OPTS = None  # main() replaces this with global application options
@@ -82,6 +106,21 @@ DEFAULT_KEY='geo.himawari.8.ahi.file.delta.hsf.image.complete'
 DEFAULT_MESSAGE_TTL = 72 * 60 * 60 * 1000   # 72h time-to-live as milliseconds, used for durable queues named after host
 DEFAULT_RECONNECT_TIME = 30
 DEFAULT_HORIZON_SEC = 5.0
+DEFAULT_PREFETCH_COUNT = 100  # unacknowledged messages the server may push ahead of our processing
+DEFAULT_ACK_BATCH_SIZE = 32  # acknowledge this many messages at once with multiple=True
+DEFAULT_ACK_FLUSH_SEC = 1.0  # acknowledge anything pending at least this often on quiet streams
+DEFAULT_DISPATCH_BATCH = 256  # most queued messages the multi-server dispatcher takes in one pass
+
+HOSTNAME = socket.gethostname()  # default durable queue name
+
+# metadata keys added to every message
+if sys.version_info[0] > 2:  # spelled out so type checkers skip the py2 branch
+    _intern = sys.intern
+else:
+    _intern = intern
+KEY_TOPIC = _intern('__topic__')
+KEY_RECEPTION_TIME = _intern('__reception_time__')
+KEY_RECEPTION_HOST = _intern('__reception_host__')
 
 
 class TimeoutException(Exception):
@@ -104,42 +143,134 @@ def _deprecated_default_callback(routing_key, body):
     LOG.debug(repr(body))
 
 
+class OutputFlusher(object):
+    """
+    Flush stdout once every max_pending emitted messages, instead of a write() system call per message.
+    With max_pending above 1 the caller is responsible for calling flush() when it goes idle.
+    """
+    def __init__(self, max_pending=1):
+        self.max_pending = max_pending
+        self.pending = 0
+
+    def emitted(self):
+        self.pending += 1
+        if self.pending >= self.max_pending:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.pending = 0
+            sys.stdout.flush()
+
+
+OUTPUT = OutputFlusher()  # main() configures this from --flush-every
+
+
 def _missing_(*args, **kwargs):
     """pseudo-constructor used to make sure all keys resolve"""
     return '?UNKNOWN?'
 
 
-def json_emit(topic, content, format_str):
-    try:
-        if format_str is not None and format_str not in ('?', '*'):
-            discontent = defaultdict(_missing_)
-            try:
-                discontent.update(content)
-                s = format_str.format_map(discontent)
-            except AttributeError as welcome_to_the_antique_shoppe:
-                from string import Formatter
-                parts = Formatter().parse(format_str)
-                upheaval = dict((part[1], discontent[part[1]]) for part in parts)
-                s = format_str.format(**upheaval)
-            print(s)
+def _format_field_names(format_str):
+    """names of the content keys used by a format string, or None if it uses positional fields"""
+    from string import Formatter
+    names = []
+    for _, field_name, format_spec, _ in Formatter().parse(format_str):
+        if field_name is None:
+            continue
+        name = re.split(r'[.\[]', field_name, 1)[0]
+        if not name or name.isdigit():
+            return None
+        names.append(name)
+        if format_spec and '{' in format_spec:  # nested fields, e.g. {value:{width}}
+            nested = _format_field_names(format_spec)
+            if nested is None:
+                return None
+            names.extend(nested)
+    return tuple(sorted(set(names)))
+
+
+class JsonEmitter(object):
+    """
+    Write message content to stdout according to a format string, see json_emit.
+    The format string is parsed and the output mode chosen once, not for every message.
+    """
+    def __init__(self, format_str):
+        self.format_str = format_str
+        self.field_names = None
+        if format_str is None:
+            self._emit = self._emit_dump
         elif format_str == '?':
-            print('v'*25)
-            keys = list(sorted(content.keys()))
-            for key in keys:
-                print('%24s: %s' % (key, content[key]))
-            print('^'*25)
-        elif format_str == '*':  # null-terminated json
-            toco = (topic, content)
-            txt = json.dumps(toco) + '\0'
-            sys.stdout.write(txt)
+            self._emit = self._emit_debug
+        elif format_str == '*':
+            self._emit = self._emit_null_terminated
         else:
-            # Dumpmode default is just line-output content with topic prefix:
-            loco = json.dumps(content)
-            txt = "{}: {}\n".format(topic, repr(loco))
-            sys.stdout.write(txt)
-    except KeyError as missing:
-        LOG.error('skipping message, missing key %s in %s' % (str(missing), repr(content)))
-    sys.stdout.flush()
+            self.field_names = _format_field_names(format_str)
+            self._emit = self._emit_format if self.field_names is not None else self._emit_format_map
+
+    def __call__(self, topic, content):
+        try:
+            self._emit(topic, content)
+        except KeyError as missing:
+            LOG.error('skipping message, missing key %s in %r', missing, content)
+        OUTPUT.emitted()
+
+    def _emit_format(self, topic, content):
+        missing = _missing_()
+        values = dict((name, content[name] if name in content else missing) for name in self.field_names)
+        try:
+            s = self.format_str.format(**values)
+        except AttributeError as missing_attribute:
+            raise KeyError(str(missing_attribute))
+        print(s)
+
+    def _emit_format_map(self, topic, content):
+        # positional fields in the format string, resolve keys per message
+        discontent = defaultdict(_missing_)
+        try:
+            discontent.update(content)
+            s = self.format_str.format_map(discontent)
+        except AttributeError as welcome_to_the_antique_shoppe:
+            from string import Formatter
+            parts = Formatter().parse(self.format_str)
+            upheaval = dict((part[1], discontent[part[1]]) for part in parts)
+            s = self.format_str.format(**upheaval)
+        print(s)
+
+    def _emit_debug(self, topic, content):
+        print('v'*25)
+        keys = list(sorted(content.keys()))
+        for key in keys:
+            print('%24s: %s' % (key, content[key]))
+        print('^'*25)
+
+    def _emit_null_terminated(self, topic, content):
+        toco = (topic, content)
+        if PY_MAJOR_VERSION == 2:
+            sys.stdout.write(json.dumps(toco) + '\0')
+        else:
+            # nothing else is written as text in this mode, so the byte stream keeps the order
+            sys.stdout.buffer.write(json_dumps_bytes(toco) + b'\0')
+
+    def _emit_dump(self, topic, content):
+        # Dumpmode default is just line-output content with topic prefix:
+        loco = json.dumps(content)
+        txt = "{}: {}\n".format(topic, repr(loco))
+        sys.stdout.write(txt)
+
+
+def json_emit(topic, content, format_str):
+    """emit a single message; Dispatcher keeps a JsonEmitter instead of re-parsing format_str per message"""
+    JsonEmitter(format_str)(topic, content)
+
+
+def raw_emit(topic, body):
+    """write "topic: body" for an undecoded message body, used for --raw"""
+    if PY_MAJOR_VERSION == 2:
+        sys.stdout.write('%s: %s\n' % (topic, body))
+    else:
+        sys.stdout.buffer.write(topic.encode('utf-8') + b': ' + body + b'\n')
+    OUTPUT.emitted()
 
 
 class test_adde_abi_callback(object):
@@ -166,17 +297,56 @@ class test_adde_abi_callback(object):
         sys.stdout.flush()
 
 
-def acknowledge_after_callback_wrapper(ch, method, properties, body, callback, timeout=None):
-    try:
-        content = json.loads(body.decode('utf-8'))
-    except ValueError as invalid_format:
-        LOG.error("ignoring message: unable to deserialize JSON dictionary %s" % repr(body))
-        content = None
-    if content is not None:
-        callback(method.routing_key, content)
-    ch.basic_ack(delivery_tag=method.delivery_tag)
-    if timeout:
-        alarm(timeout)
+class BatchedAcknowledger(object):
+    """
+    Consumer callback which acknowledges messages after the callback has processed them.
+    Acknowledgements are sent batch_size messages at a time using multiple=True,
+    flush() sends any pending acknowledgement (called periodically by AmqpExchange.consume).
+    With decode=False the callback receives the message body as undecoded bytes.
+    """
+    def __init__(self, callback, timeout=None, batch_size=DEFAULT_ACK_BATCH_SIZE, decode=True):
+        self.callback = callback
+        self.timeout = timeout
+        self.decode = decode
+        self.batch_size = max(1, batch_size)
+        self.channel = None
+        self.last_delivery_tag = None
+        self.count = 0
+
+    def __call__(self, ch, method, properties, body):
+        if not self.decode:
+            content = body
+        else:
+            try:
+                content = json_loads_bytes(body)
+            except ValueError as invalid_format:
+                LOG.error("ignoring message: unable to deserialize JSON dictionary %r", body)
+                content = None
+        if content is not None:
+            self.callback(method.routing_key, content)
+        self.channel = ch
+        self.last_delivery_tag = method.delivery_tag
+        self.count += 1
+        if self.count >= self.batch_size:
+            self.flush()
+        if self.timeout:
+            alarm(self.timeout)
+
+    def flush(self):
+        if not self.count:
+            return
+        # acknowledges every message up to and including the last one
+        self.channel.basic_ack(delivery_tag=self.last_delivery_tag, multiple=True)
+        self.count = 0
+
+    def reset(self, channel=None):
+        """
+        forget pending acknowledgements, e.g. after the channel was lost:
+        delivery tags are per channel, the server redelivers unacknowledged messages
+        """
+        self.channel = channel
+        self.last_delivery_tag = None
+        self.count = 0
 
 
 class AmqpExchange(object):
@@ -186,12 +356,15 @@ class AmqpExchange(object):
         durable=True ==> use hostname as durable queue name
         durable="queuename" ==> use that queue name
     Default message TTL on durable queues is 72h to avoid disk/mem DoS.
+    prefetch_count limits how many unacknowledged messages the server delivers
+    ahead of the consumer; 1 costs a network round-trip per message.
     """
 
     def __init__(self, host=DEFAULT_SERVER,
                  user=DEFAULT_USER, password=DEFAULT_PASSWORD,
                  exchange=DEFAULT_EXCHANGE, key=DEFAULT_KEY,
-                 durable=None, timeout=None, **ignored):
+                 durable=None, timeout=None,
+                 prefetch_count=DEFAULT_PREFETCH_COUNT, **ignored):
 
         credentials = pika.PlainCredentials(user, password)
         conn_params = pika.ConnectionParameters(host=host,
@@ -201,11 +374,15 @@ class AmqpExchange(object):
         self.key = key
         self.timeout = timeout
         self._durable = durable
+        self.prefetch_count = prefetch_count
+        self._acknowledger = None
+        # message properties are the same for every publish
+        self._publish_properties = pika.BasicProperties(content_type='text/json', delivery_mode=1)
 
         self.connection = pika.BlockingConnection(conn_params)
         self.channel = self.connection.channel()
 
-    def consume(self, callback=None, exchange=None, key=None, timeout=None):
+    def consume(self, callback=None, exchange=None, key=None, timeout=None, decode=True):
         exchange = exchange or self.exchange
         key = key or self.key
         timeout = timeout or self.timeout
@@ -218,7 +395,7 @@ class AmqpExchange(object):
                                     queue=queue_name,
                                     routing_key=key)
         else:
-            queue_name = socket.gethostname() if self._durable is True else self._durable
+            queue_name = HOSTNAME if self._durable is True else self._durable
             try:  # binding to pre-existing queue we presumably made in a prior run
                 self.channel.queue_bind(exchange=exchange,
                                         queue=queue_name,
@@ -232,38 +409,63 @@ class AmqpExchange(object):
                                         queue=queue_name,
                                         routing_key=key)
 
-        self.channel.basic_qos(prefetch_count=1)
-        wrapped_callback = partial(acknowledge_after_callback_wrapper, callback=callback or default_callback, timeout=timeout)
+        # per-consumer limit (the default, not global to the connection)
+        self.channel.basic_qos(prefetch_count=self.prefetch_count)
+        # keep the ack batch below the prefetch window so the server never stalls waiting on us
+        batch_size = min(DEFAULT_ACK_BATCH_SIZE, max(1, self.prefetch_count // 2)) if self.prefetch_count else DEFAULT_ACK_BATCH_SIZE
+        wrapped_callback = self._acknowledger = BatchedAcknowledger(callback or default_callback, timeout=timeout, batch_size=batch_size, decode=decode)
         if PIKA_MAJOR_VERSION < 1:
             self.channel.basic_consume(wrapped_callback, queue=queue_name)
         else:
             self.channel.basic_consume(queue_name, wrapped_callback)
+        self._schedule_ack_flush()
         if timeout:
             alarm(timeout)
         try:
-            LOG.info("about to consume {0}/{1}/{2}".format(self.host, exchange, key))
+            LOG.info("about to consume %s/%s/%s", self.host, exchange, key)
             self.channel.start_consuming()
         except KeyboardInterrupt:
             LOG.warning('keyboard interrupt')
             raise
 
+    def _schedule_ack_flush(self):
+        if PIKA_MAJOR_VERSION < 1:
+            self.connection.add_timeout(DEFAULT_ACK_FLUSH_SEC, self._periodic_ack_flush)
+        else:
+            self.connection.call_later(DEFAULT_ACK_FLUSH_SEC, self._periodic_ack_flush)
+
+    def _periodic_ack_flush(self):
+        if self._acknowledger is None or self.channel is None:
+            return
+        self._acknowledger.flush()
+        OUTPUT.flush()  # output batched by --flush-every
+        self._schedule_ack_flush()
+
     def produce(self, content_dict, key=None, exchange=None):
-        content_json = json.dumps(content_dict)
+        content_json = json_dumps_bytes(content_dict)
         exchange = exchange or self.exchange
         key = key or self.key
         self.channel.basic_publish(exchange,
                                    key,
                                    content_json,
-                                   pika.BasicProperties(content_type='text/json',
-                                                        delivery_mode=1))
+                                   self._publish_properties)
 
     def close(self):
         if not self.connection:
             return
+        # also called on the way out of a failed connection, which may be closed already
         if self.channel is not None:
-            self.channel.close()
+            if self._acknowledger is not None:
+                try:
+                    self._acknowledger.flush()
+                except Exception:
+                    LOG.debug('unable to send pending acknowledgements', exc_info=True)
+                self._acknowledger = None
+            if self.channel.is_open:
+                self.channel.close()
             self.channel = None
-        self.connection.close()
+        if self.connection.is_open:
+            self.connection.close()
         self.connection = None
 
 
@@ -279,147 +481,247 @@ def _debug(type, value, tb):
 
 
 def worker_main(server_info, queue, reconnect_delay=DEFAULT_RECONNECT_TIME, reconnect_tries=None):
-    """yield message dictionaries to a Queue
+    """yield undecoded message bodies to a Queue along with their POSIX reception time, see decode_queued_message
     """
     host = server_info['host']
-    def queue_callback(routing_key, json_dict, queue=queue, host=host):
-        now = datetime.utcnow()
-        try:
-            # provide host and preferred reception time upstream from multi-host
-            content = {'__reception_time__': now.isoformat(),
-                       '__reception_host__': host}
-            content.update(json_dict)
-            # content.update(json.loads(json_txt.decode('utf-8')))
-        except ValueError:
-            LOG.error('invalid JSON from %s: %s' % (host, repr(json_dict)))
-            raise
-        queue.put((now, host, routing_key, content))
+    def queue_callback(routing_key, body, queue=queue, host=host):
+        # the JSON body is passed on as bytes rather than pickling a decoded dictionary;
+        # the dispatcher decodes it once
+        queue.put((time.time(), host, routing_key, body))
 
     while (reconnect_tries is None) or (reconnect_tries > 0):
-        LOG.info("connecting to %s" % repr(server_info))
+        LOG.info("connecting to %r", server_info)
         amqp = AmqpExchange(**server_info)
         try:
-            LOG.debug("consuming messages from %s" % repr(server_info))
-            amqp.consume(queue_callback)
+            LOG.debug("consuming messages from %r", server_info)
+            amqp.consume(queue_callback, decode=False)
         except KeyboardInterrupt as weredone:
             LOG.warning("KeyboardInterrupt inducing worker shutdown")
             break
         except:
-            exc_txt = traceback.format_exc()
-            LOG.error('exception in server connection %s:\n%s' % (host, exc_txt))
-        amqp.close()
+            LOG.error('exception in server connection %s:\n%s', host, traceback.format_exc())
+        finally:  # send the batched acknowledgements, also on shutdown
+            amqp.close()
 
-        LOG.warning("sleeping %ss before reconnecting to %s" % (str(reconnect_delay), host))
+        LOG.warning("sleeping %ss before reconnecting to %s", reconnect_delay, host)
         if reconnect_tries is not None:
             reconnect_tries -= 1
-            LOG.info("%d retries remaining for %s" % (reconnect_tries, host))
+            LOG.info("%d retries remaining for %s", reconnect_tries, host)
         time.sleep(reconnect_delay)
 
 
+def decode_queued_message(when, host, body):
+    """decode a message body queued by worker_main, returning a dictionary or None if it is unusable
+    """
+    try:
+        json_dict = json_loads_bytes(body)
+    except ValueError:
+        LOG.error('invalid JSON from %s: %r', host, body)
+        return None
+    if json_dict is None:
+        return None
+    if not isinstance(json_dict, dict):
+        LOG.error('ignoring message from %s: not a JSON dictionary %r', host, body)
+        return None
+    # provide host and preferred reception time upstream from multi-host
+    content = {KEY_RECEPTION_TIME: datetime.utcfromtimestamp(when).isoformat(),
+               KEY_RECEPTION_HOST: host}
+    content.update(json_dict)
+    return content
+
+
+def _free_names(expr):
+    """names an expression looks up from its evaluation namespace, in order of appearance"""
+    tree = ast.parse(expr.strip(), mode='eval')
+    bound = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            bound.add(node.id)  # comprehension targets
+        elif isinstance(node, getattr(ast, 'arg', ())):
+            bound.add(node.arg)  # lambda arguments
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id not in bound and node.id not in names:
+            names.append(node.id)
+    return names
+
+
+def _undefined_name(name):
+    raise NameError("name %r is not defined" % name)
+
+
+def compile_message_expression(expr, namespace, missing_as_none=False):
+    """
+    compile an expression on message content into a function f(msg), so that it is a plain call per message
+    rather than an eval(); names resolve the same way as with eval():
+        missing_as_none=False: like eval(expr, namespace, dict(msg)), message keys first, then namespace and builtins
+        missing_as_none=True: like eval(expr, namespace, NoneDict(msg)), message keys only, None if missing
+    """
+    compile(expr, '<string>', 'eval')  # report syntax errors as before
+    fallback = {}
+    lines = ['def message_expression(__msg__):']
+    for name in _free_names(expr):
+        if missing_as_none:
+            lines.append('    %s = __msg__[%r] if %r in __msg__ else __none_for_missing__(%r)' % (name, name, name, name))
+            continue
+        if name in namespace:
+            fallback[name] = namespace[name]
+        elif hasattr(builtins, name):
+            fallback[name] = getattr(builtins, name)
+        else:
+            lines.append('    %s = __msg__[%r] if %r in __msg__ else __undefined__(%r)' % (name, name, name, name))
+            continue
+        lines.append('    %s = __msg__[%r] if %r in __msg__ else __fallback__[%r]' % (name, name, name, name))
+    lines.append('    return (\n%s\n    )' % expr.strip())
+    function_namespace = dict(namespace)
+    function_namespace['__fallback__'] = fallback
+    function_namespace['__none_for_missing__'] = _none_for_missing_key
+    function_namespace['__undefined__'] = _undefined_name
+    exec(compile('\n'.join(lines), '<string>', 'exec'), function_namespace)
+    return function_namespace['message_expression']
+
+
 class Transforms(object):
     """transform dictionary contents with eval expressions"""
-    _trans = None
-    _ns = None
+    __slots__ = (
+        '_trans',
+        '_ns',
+        '_namespace',  # evaluation namespace, built once since it does not change per message
+        '_written',  # keys assigned by the rules so far
+        '_needs_snapshot',  # true if a rule reads a key assigned by an earlier rule
+    )
 
     def __init__(self, transforms=None, extra_eval_namespace=None):
         self._trans = []
+        self._written = set()
+        self._needs_snapshot = False
         self._ns = dict(extra_eval_namespace or {})
+        self._namespace = dict(globals())
+        self._namespace.update(self._ns)
         if transforms:
             for t in transforms:
                 self.add(t)
 
     def namespace(self):
-        d = globals()
-        if self._ns:
-            d.update(self._ns)
-        return d
+        return self._namespace
 
     def add(self, key, transform=None):
         if transform is None:
             key, transform = key.split('=')
             key = key.strip()
             transform = transform.strip()
-        code = compile(transform, '<string>', 'eval')
-        self._trans.append((key, code))
+        self._trans.append((key, compile_message_expression(transform, self._namespace)))
+        # rules see the message as it was before any rule; only keep a separate copy of it
+        # when a rule would otherwise see the result of an earlier one
+        if self._written.intersection(_free_names(transform)):
+            self._needs_snapshot = True
+        self._written.add(key)
 
     def __call__(self, msg):
-        old_msg = dict(msg)
         new_msg = dict(msg)
-        LOG.debug("transforming message using %d rules" % len(self._trans))
-        for key, code in self._trans:
-            new_val = eval(code, self.namespace(), old_msg)
-            LOG.debug("transformed %s: %s => %s" % (key, old_msg.get(key, "<empty>"), new_val))
+        old_msg = dict(msg) if self._needs_snapshot else new_msg
+        LOG.debug("transforming message using %d rules", len(self._trans))
+        for key, transform in self._trans:
+            new_val = transform(old_msg)
+            LOG.debug("transformed %s: %s => %s", key, old_msg.get(key, "<empty>"), new_val)
             new_msg[key] = new_val
         return new_msg
 
 
+_MISSING_KEYS_WARNED = set()  # type: Set[str]  # names already reported missing, so each is only logged once
+
+
+def _none_for_missing_key(item):
+    if item not in _MISSING_KEYS_WARNED:
+        _MISSING_KEYS_WARNED.add(item)
+        LOG.warning("key %s not present in dictionary; using None", item)
+    return None
+
+
 class NoneDict(dict):
     "dictionary that returns None instead of throwing KeyError"
-    def __getitem__(self, item):
-        if item not in self:
-            LOG.warning("key {0} not present in dictionary; using None".format(item))
-            return None
-        return dict.__getitem__(self, item)
+    __slots__ = ()
+
+    def __missing__(self, item):
+        # only called by dict lookups that miss, present keys take the C fast path
+        return _none_for_missing_key(item)
 
 
 class Dispatcher(object):
 
     QUIT = "object to return when program should exit"
-    transforms = None  # callable that munges a message before emitting
-    key_code = None  # expression to evaluate to key a message
-    score_code = None  # lambda function comparing two messages and returning one, or False if user provided a comparator
-    active_keys = None  # dict of recent keys being deduplicated: {key: when-first-seen}
-    msg_buffer = None  # defaultdict of {key: [(when, source, message), ... ]}; or None, if messages are not being buffered and scored before forwarding
-    horizon = None  # timedelta, how long to hold onto keys before discard
-    shuffle = True  # if true, shuffle messages having the same keys before choosing one
-    json_format_str = None  # format string for JSON content
-    callback = None  # None, or callable(topic:str, content:dict)
-    timeout = None  # seconds to set alarm() for after each emit()
-    extra_eval_namespace = None  # extra symbols to use with eval()
-    extra_default_payload = None  # dictionary of additional keys to provide defaults for if not already present
+    # attributes are slots rather than a per-instance __dict__, since they are read for every message
+    __slots__ = (
+        'transforms',  # callable that munges a message before emitting
+        'key_code',  # expression to evaluate to key a message
+        'score_code',  # lambda function comparing two messages and returning one, or False if user provided a comparator
+        '_key_fn',  # key_code compiled to a function of the message
+        '_score_fn',  # score_code compiled to a function of the message
+        '_comparator',  # user-provided lambda a,b comparator used instead of compare(), when score_code is False
+        'active_keys',  # dict of recent keys being deduplicated: {key: when-first-seen as POSIX time}
+        '_expiry_heap',  # heap of (window-expiry, sequence, key) for active_keys, soonest expiry first
+        '_expiry_seq',  # sequence numbers so that keys never get compared in the heap
+        'msg_buffer',  # dict of {key: [(when, source, message), ... ]}; or None, if messages are not being buffered and scored before forwarding
+        'horizon',  # seconds, how long to hold onto keys before discard
+        'shuffle',  # if true, shuffle messages having the same keys before choosing one
+        'json_format_str',  # format string for JSON content
+        'json_emit',  # JsonEmitter for json_format_str
+        'callback',  # None, or callable(topic:str, content:dict)
+        'timeout',  # seconds to set alarm() for after each emit()
+        'extra_eval_namespace',  # extra symbols to use with eval()
+        'extra_default_payload',  # dictionary of additional keys to provide defaults for if not already present
+        '_namespace',  # globals plus extra_eval_namespace, built once
+    )
 
     def __init__(self, transforms, extra_eval_namespace, opts, extra_default_payload=None):
         super(Dispatcher, self).__init__()
+        self.key_code = self.score_code = self._key_fn = self._score_fn = self._comparator = None
+        self.active_keys = self._expiry_heap = self._expiry_seq = self.msg_buffer = self.horizon = None
+        self.shuffle = True
+        self.json_format_str = self.callback = self.timeout = None
         self.transforms = transforms
         self.extra_eval_namespace = dict(extra_eval_namespace)
+        self._namespace = dict(globals())
+        self._namespace.update(self.extra_eval_namespace)
         if opts.timeout:
             self.timeout = opts.timeout
         if opts.key is not None:
             self.key_code = compile(opts.key, '<string>', 'eval')
+            self._key_fn = compile_message_expression(opts.key, self.namespace(), missing_as_none=True)
             self.active_keys = {}
+            self._expiry_heap = []
+            self._expiry_seq = count()
         if opts.score is not None:
             if opts.score.strip().startswith('lambda'):  # then it's a full comparator
                 score_code = opts.score
-                LOG.debug("parsing scoring lambda a,b function '%s'" % score_code)
-                self.compare = eval(compile(score_code, '<string>', 'eval'), self.namespace())
+                LOG.debug("parsing scoring lambda a,b function '%s'", score_code)
+                self._comparator = eval(compile(score_code, '<string>', 'eval'), self.namespace())
                 self.score_code = False  # not truthy but not None, implies go straight to compare()
             else:
                 self.score_code = compile(opts.score, '<string>', 'eval')
-            self.msg_buffer = defaultdict(list)
+                self._score_fn = compile_message_expression(opts.score, self.namespace())
+            self.msg_buffer = {}
         if opts.json is not None:
             self.json_format_str = opts.json
             # LOG.info("json format str is %r" % opts.json)
+        self.json_emit = JsonEmitter(self.json_format_str)
         if opts.window is not None:
-            self.horizon = timedelta(seconds=opts.window)
+            self.horizon = float(opts.window)
         elif opts.key is not None:
-            self.horizon = timedelta(seconds=DEFAULT_HORIZON_SEC)
+            self.horizon = DEFAULT_HORIZON_SEC
         if opts.callback is not None:
             self.callback = eval(opts.callback, self.namespace())
         self.extra_default_payload = {} if not extra_default_payload else dict(extra_default_payload)
 
     def namespace(self):
-        d = globals()
-        d.update(self.extra_eval_namespace)
-        return d
+        return self._namespace
 
     def add_default_metadata(self, topic, msg):
-        if '__topic__' not in msg:
-            msg['__topic__'] = topic
-        if '__reception_time__' not in msg:
-            msg['__reception_time__'] =  datetime.utcnow().isoformat()
+        msg.setdefault(KEY_TOPIC, topic)
+        if KEY_RECEPTION_TIME not in msg:  # only format a time if the message has none yet
+            msg[KEY_RECEPTION_TIME] =  datetime.utcnow().isoformat()
         for k, v in self.extra_default_payload.items():
-            if k not in msg:
-                msg[k] = v
+            msg.setdefault(k, v)
 
     def emit(self, topic, msg):
         """send a message to downstream, based on user options
@@ -432,82 +734,94 @@ class Dispatcher(object):
         if self.callback is not None:
             self.callback(topic, msg)
         else:
-            json_emit(topic, msg, self.json_format_str)
+            self.json_emit(topic, msg)
 
     def key_for_msg(self, msg):
         """given key_code is a compiled expression to evaluate on message content
         """
         try:
-            return eval(self.key_code, self.namespace(), NoneDict(msg)) if self.key_code else None
+            return self._key_fn(msg) if self.key_code else None
         except:
-            LOG.error("could not evaluate key for %s: %s" % (repr(msg), traceback.format_exc()))
+            LOG.error("could not evaluate key for %r: %s", msg, traceback.format_exc())
             return None
 
     def score_for_msg(self, msg):
         try:
-            score = eval(self.score_code, self.namespace(), dict(msg)) if self.score_code else None
-            LOG.debug("score of %s for %s" % (score, repr(msg)))
+            score = self._score_fn(msg) if self.score_code else None
+            LOG.debug("score of %s for %r", score, msg)
             return score
         except:
-            LOG.error("could not extract score value for %s: %s" % (repr(msg), traceback.format_exc()))
+            LOG.error("could not extract score value for %r: %s", msg, traceback.format_exc())
             return None
 
     def compare(self, msg1, msg2):
-        """generic score comparator, replaced if an advanced user provides a lambda scoring function"""
+        """generic score comparator, an advanced user may provide a lambda scoring function instead (_comparator)"""
         s1, s2 = self.score_for_msg(msg1), self.score_for_msg(msg2)
         return msg1 if (s1 >= s2) else msg2
 
-    def choose_msg(self, messages):
-        """return best message of a group based on score and shuffle
+    def choose_msg(self, entries):
+        """return best (when, host, routing_key, msg) entry of a group based on message score and shuffle
         """
-        messages = list(messages)
         if self.shuffle:
-            shuffle(messages)
+            entries = list(entries)  # shuffle a copy, not the caller's list
+            shuffle(entries)
             LOG.debug("shuffling candidates")
-        LOG.debug("choosing best of %d candidates" % len(messages))
+        elif not isinstance(entries, (list, tuple)):
+            entries = list(entries)
+        LOG.debug("choosing best of %d candidates", len(entries))
 
         # if no scoring code, the first message is best
         if self.score_code is None:
             LOG.warning("choosing without a scoring mechanism - this should not happen")
-            return messages[0]
+            return entries[0]
+        elif self.score_code is False:  # user-provided comparator, given the messages
+            comparator = self._comparator
+            return reduce(lambda a, b: a if comparator(a[3], b[3]) is a[3] else b, entries)
         else:
-            return reduce(self.compare, messages)
+            # scores each message once; like compare(), the first of equally scored messages wins
+            score_for_msg = self.score_for_msg
+            return max(entries, key=lambda entry: score_for_msg(entry[3]))
 
     def _dismiss_active_key(self, key):
         """do any needed handling of key we're not longer interested in
         """
         if self.msg_buffer is None:  # then we don't have anything to do - nothing is pending
             return
-        competing_msgs = self.msg_buffer[key]
+        competing_msgs = self.msg_buffer.pop(key, None)
         if not competing_msgs:
-            LOG.error("no messages to compete for key %s" % repr(key))
+            LOG.error("no messages to compete for key %r", key)
             return
-        del self.msg_buffer[key]
-        routing_key_lut = dict([(id(msg), (host, routing_key)) for when, host, routing_key, msg in competing_msgs])
-        winner = self.choose_msg([x[-1] for x in competing_msgs])
-        host, routing_key = routing_key_lut[id(winner)]
-        LOG.info("chose message from %s:%s among %d competitors for key %s in this window" % (host, routing_key, len(competing_msgs), repr(key)))
+        when, host, routing_key, winner = self.choose_msg(competing_msgs)
+        LOG.info("chose message from %s:%s among %d competitors for key %r in this window", host, routing_key, len(competing_msgs), key)
         self.emit(routing_key, winner)
 
+    def _activate_key(self, key, when):
+        """record when the window for a key was started"""
+        self.active_keys[key] = when
+        heappush(self._expiry_heap, (when + self.horizon, next(self._expiry_seq), key))
+
     def _clean_expired(self):
-        now = datetime.utcnow()
+        now = time.time()
+        heap = self._expiry_heap
         delset = []
-        for key, when in self.active_keys.items():
-            if (when + self.horizon) < now:
-                delset.append(key)
-                self._dismiss_active_key(key)
-        if delset:
-            LOG.debug("closing window for keys: %s" % repr(delset))
-        for key in delset:
+        while heap and heap[0][0] < now:
+            expiry, _, key = heappop(heap)
+            when = self.active_keys.get(key)
+            if when is None or (when + self.horizon) != expiry:
+                continue  # stale entry, the key has been dismissed or re-activated since
+            delset.append(key)
+            self._dismiss_active_key(key)
             del self.active_keys[key]
+        if delset:
+            LOG.debug("closing window for keys: %r", delset)
 
     def max_sleep_til_next_window(self):
         """how many seconds we can afford to stay blocked before we have to check on something"""
-        now = datetime.utcnow()
+        now = time.time()
         if not self.active_keys:
             return None   # indefinite wait
-        expiry = min(self.active_keys.values()) + self.horizon
-        delay = max(0.0, (expiry - now).total_seconds())
+        expiry = self._expiry_heap[0][0]
+        delay = max(0.0, expiry - now)
         # LOG.debug("next cleanup happens no later than %s from now" % delay)
         return delay
 
@@ -518,46 +832,57 @@ class Dispatcher(object):
         # if set(msg.keys()) != mk:
         #     raise AssertionError('message was modified: keys %r changed' % (mk ^ set(msg.keys())))
         if key not in self.active_keys:
-            LOG.debug("emitting race winner %s:%s for key %s" % (host, when, repr(key)))
+            LOG.debug("emitting race winner %s:%s for key %r", host, when, key)
             self.emit(routing_key, msg)
-            self.active_keys[key] = when  # record when window for this was started
+            self._activate_key(key, when)
         else:
-            LOG.info('ignoring redundant message from %s for key %s' % (host, repr(key)))
+            LOG.info('ignoring redundant message from %s for key %r', host, key)
 
     def _dispatch_compete(self, when, host, routing_key, msg):
         key = self.key_for_msg(msg)
         if key not in self.active_keys:
-            LOG.debug("window opening for key %s" % repr(key))
-            self.active_keys[key] = when  # record when window for this was started
-        self.msg_buffer[key].append((when, host, routing_key, msg))
-        LOG.debug("added %s:%s to competition for key %s, started at %s, has %d entries" % (host, when, repr(key), repr(self.active_keys[key]), len(self.msg_buffer[key])))
+            LOG.debug("window opening for key %r", key)
+            self._activate_key(key, when)
+        bucket = self.msg_buffer.get(key)
+        if bucket is None:
+            bucket = self.msg_buffer[key] = []
+        bucket.append((when, host, routing_key, msg))
+        LOG.debug("added %s:%s to competition for key %r, started at %r, has %d entries", host, when, key, self.active_keys[key], len(bucket))
         # we'll come back to this content when the window expires
 
-    def __call__(self, when=None, host=None, routing_key=None, msg=None, *args, **kwargs):
-        """dispatch a message, returning how long to wait for next message, or None"""
-        if self.active_keys:
-            self._clean_expired()
-
-        # Case 0: No message provided, we just wanted aisle 6 cleaned up
-        if msg is None:
-            return self.max_sleep_til_next_window()
-
+    def _dispatch(self, when, host, routing_key, msg):
         # Case 1: if we have a key but no score, first message for a given key goes out
         #         and the rest are dropped within the window
         if (self.key_code is not None) and (self.score_code is None):
             self._dispatch_race(when, host, routing_key, msg)
-            return self.max_sleep_til_next_window()
 
         # Case 2: if we have a key and a scoring mechanism, buffer messages
         #         and compete them when window closes
         elif (self.key_code is not None) and (self.score_code is not None):
             self._dispatch_compete(when, host, routing_key, msg)
-            return self.max_sleep_til_next_window()
 
         # Case 3: no key and no score, we just emit everything
         else:
             self.emit(routing_key, msg)
-            return None
+
+    def __call__(self, when=None, host=None, routing_key=None, msg=None, *args, **kwargs):
+        """dispatch a message, returning how long to wait for next message, or None"""
+        if self.active_keys:
+            self._clean_expired()
+
+        # Case 0: No message provided (msg is None), we just wanted aisle 6 cleaned up
+        if msg is not None:
+            self._dispatch(when, host, routing_key, msg)
+        return self.max_sleep_til_next_window()
+
+    def dispatch_batch(self, items):
+        """dispatch a sequence of (when, host, routing_key, msg) with a single cleanup pass,
+        returning how long to wait for next message, or None"""
+        if self.active_keys:
+            self._clean_expired()
+        for when, host, routing_key, msg in items:
+            self._dispatch(when, host, routing_key, msg)
+        return self.max_sleep_til_next_window()
 
 
 def multi_main(servers, opts, args, extra_eval_namespace):
@@ -573,9 +898,9 @@ def multi_main(servers, opts, args, extra_eval_namespace):
     transforms = Transforms(opts.transforms, extra_eval_namespace)
     LOG.debug("creating message dispatcher")
     dispatch = Dispatcher(transforms, extra_eval_namespace, opts)
-    LOG.debug("creating %d worker processes" % len(servers))
+    LOG.debug("creating %d worker processes", len(servers))
     workers = [mp.Process(target=worker_main, args=(server, queue)) for server in servers]
-    LOG.info("starting %d worker processes" % len(workers))
+    LOG.info("starting %d worker processes", len(workers))
     [w.start() for w in workers]
 
     import atexit
@@ -588,7 +913,7 @@ def multi_main(servers, opts, args, extra_eval_namespace):
         atexit.register(exterminate)
 
     if opts.timeout:
-        LOG.info("priming timeout for %s seconds" % opts.timeout)
+        LOG.info("priming timeout for %s seconds", opts.timeout)
         signal(SIGALRM, handle_timeout)
         alarm(opts.timeout)
 
@@ -597,14 +922,28 @@ def multi_main(servers, opts, args, extra_eval_namespace):
     try:
         while max_wait is not Dispatcher.QUIT:
             try:
-                when, host, routing_key, msg = queue.get(True, max_wait)
-                LOG.debug("received message from %s" % host)
+                queued = [queue.get(True, max_wait)]
             except Queue.Empty as timed_out_for_cleanup:
                 LOG.debug("dispatching a cleanup pass after timeout")
                 max_wait = dispatch()
+                OUTPUT.flush()
                 continue
-            max_wait = dispatch(when, host, routing_key, msg)
-            LOG.debug("have %ss to await next message before cleanup" % (max_wait if (max_wait is not None) else "eon"))
+            # take whatever else is already waiting, so the batch shares one cleanup pass
+            while len(queued) < DEFAULT_DISPATCH_BATCH:
+                try:
+                    queued.append(queue.get_nowait())
+                except Queue.Empty:
+                    break
+            LOG.debug("received %d message(s)", len(queued))
+            items = []
+            for when, host, routing_key, body in queued:
+                msg = decode_queued_message(when, host, body)
+                if msg is not None:
+                    items.append((when, host, routing_key, msg))
+            max_wait = dispatch.dispatch_batch(items)
+            if len(queued) < DEFAULT_DISPATCH_BATCH:  # caught up, don't hold output back while waiting
+                OUTPUT.flush()
+            LOG.debug("have %ss to await next message before cleanup", max_wait if (max_wait is not None) else "eon")
     except KeyboardInterrupt as solongandthanksforallthefish:
         LOG.warning("keyboard interrupt, exiting")
     except TimeoutException as zzz:
@@ -618,6 +957,197 @@ def multi_main(servers, opts, args, extra_eval_namespace):
     return rc
 
 
+class SelectConsumer(object):
+    """
+    Consume from one server on an IOLoop shared with other servers, reconnecting after failures.
+    Durable queues are declared with the same arguments AmqpExchange creates them with.
+    on_message(when, host, routing_key, body) receives the undecoded body, see worker_main.
+    """
+    def __init__(self, ioloop, server_info, on_message, reconnect_delay=DEFAULT_RECONNECT_TIME):
+        self.ioloop = ioloop
+        self.host = server_info['host']
+        self.exchange = server_info.get('exchange') or DEFAULT_EXCHANGE
+        self.key = server_info.get('key') or DEFAULT_KEY
+        self.durable = server_info.get('durable')
+        self.prefetch_count = server_info.get('prefetch_count', DEFAULT_PREFETCH_COUNT)
+        self.parameters = pika.ConnectionParameters(host=self.host,
+                                                    credentials=pika.PlainCredentials(server_info.get('user') or DEFAULT_USER,
+                                                                                      server_info.get('password') or DEFAULT_PASSWORD))
+        self.on_message = on_message
+        self.reconnect_delay = reconnect_delay
+        self.connection = None
+        self.channel = None
+        self.queue_name = None
+        self.stopping = False
+        # durable queues: binding to a pre-existing queue failed, declare it on the next channel
+        self._binding_existing = False
+        self._declare_durable = False
+        # no alarm() here, the timeout counts emitted messages and is handled by the Dispatcher
+        self._acknowledger = BatchedAcknowledger(self._message_callback, decode=False,
+                                                 batch_size=min(DEFAULT_ACK_BATCH_SIZE, max(1, self.prefetch_count // 2)) if self.prefetch_count else DEFAULT_ACK_BATCH_SIZE)
+
+    def _message_callback(self, routing_key, body):
+        self.on_message(time.time(), self.host, routing_key, body)
+
+    def start(self):
+        LOG.info("connecting to %s/%s/%s", self.host, self.exchange, self.key)
+        self.connection = pika.SelectConnection(self.parameters,
+                                                on_open_callback=self._on_connection_open,
+                                                on_open_error_callback=self._on_connection_closed,
+                                                on_close_callback=self._on_connection_closed,
+                                                custom_ioloop=self.ioloop)
+
+    def stop(self):
+        self.stopping = True
+        if self.channel is not None and self.channel.is_open:
+            try:
+                self._acknowledger.flush()
+            except Exception:
+                LOG.debug('unable to send pending acknowledgements', exc_info=True)
+        if self.connection is not None and not (self.connection.is_closing or self.connection.is_closed):
+            self.connection.close()
+
+    def _on_connection_closed(self, connection, reason):
+        self.channel = None
+        self._acknowledger.reset()
+        self._binding_existing = self._declare_durable = False
+        if self.stopping:
+            return
+        LOG.error('connection to %s failed or closed: %r', self.host, reason)
+        LOG.warning("sleeping %ss before reconnecting to %s", self.reconnect_delay, self.host)
+        self.ioloop.call_later(self.reconnect_delay, self.start)
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_channel_open(self, channel):
+        self.channel = channel
+        self._acknowledger.reset(channel)
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.basic_qos(prefetch_count=self.prefetch_count, callback=self._on_qos)
+
+    def _on_channel_closed(self, channel, reason):
+        self._acknowledger.reset()
+        if self.connection is None or self.connection.is_closing or self.connection.is_closed:
+            return
+        if self._binding_existing:
+            # no durable queue from a prior run, create it on a new channel
+            LOG.info('durable queue on %s not bound (%r), declaring it', self.host, reason)
+            self._binding_existing = False
+            self._declare_durable = True
+            self.connection.channel(on_open_callback=self._on_channel_open)
+            return
+        LOG.error('channel to %s closed: %r', self.host, reason)
+        self.connection.close()
+
+    def _on_qos(self, frame):
+        if not self.durable:
+            self.channel.queue_declare('', exclusive=True, auto_delete=True, callback=self._on_queue_declared)
+            return
+        self.queue_name = HOSTNAME if self.durable is True else self.durable
+        if self._declare_durable:
+            # https://www.rabbitmq.com/ttl.html
+            self.channel.queue_declare(self.queue_name, durable=True,
+                                       arguments={'x-message-ttl': DEFAULT_MESSAGE_TTL},
+                                       callback=self._on_queue_declared)
+        else:
+            # binding to pre-existing queue we presumably made in a prior run, the server closes the channel if it's missing
+            self._binding_existing = True
+            self.channel.queue_bind(self.queue_name, self.exchange, routing_key=self.key, callback=self._on_queue_bound)
+
+    def _on_queue_declared(self, frame):
+        self.queue_name = frame.method.queue
+        self.channel.queue_bind(self.queue_name, self.exchange, routing_key=self.key, callback=self._on_queue_bound)
+
+    def _on_queue_bound(self, frame):
+        self._binding_existing = self._declare_durable = False
+        LOG.info("about to consume %s/%s/%s", self.host, self.exchange, self.key)
+        self.channel.basic_consume(self.queue_name, self._acknowledger)
+        self._schedule_ack_flush(self.channel)
+
+    def _schedule_ack_flush(self, channel):
+        self.ioloop.call_later(DEFAULT_ACK_FLUSH_SEC, partial(self._periodic_ack_flush, channel))
+
+    def _periodic_ack_flush(self, channel):
+        if channel is not self.channel or not channel.is_open:
+            return  # a reconnect has started a new flush cycle
+        self._acknowledger.flush()
+        self._schedule_ack_flush(channel)
+
+
+def select_main(servers, opts, args, extra_eval_namespace):
+    """ like multi_main, but consume all servers from a single process sharing one pika IOLoop
+    messages are dispatched in batches of what arrived within an IOLoop pass, without a process per server
+    or pickling through a multiprocessing queue
+    :param servers: list of dictionaries with server parameters
+    :param opts: global configuration options
+    :return: 0 for success
+    """
+    from pika.adapters.select_connection import IOLoop
+    ioloop = IOLoop()
+    LOG.debug("creating payload transforms")
+    transforms = Transforms(opts.transforms, extra_eval_namespace)
+    LOG.debug("creating message dispatcher")
+    dispatch = Dispatcher(transforms, extra_eval_namespace, opts)
+
+    pending = []
+    timers = {'dispatch': None, 'cleanup': None}
+
+    def schedule_cleanup(max_wait):
+        if timers['cleanup'] is not None:
+            ioloop.remove_timeout(timers['cleanup'])
+            timers['cleanup'] = None
+        if max_wait is not None:
+            timers['cleanup'] = ioloop.call_later(max_wait, cleanup)
+
+    def cleanup():
+        timers['cleanup'] = None
+        LOG.debug("dispatching a cleanup pass after timeout")
+        schedule_cleanup(dispatch())
+        OUTPUT.flush()
+
+    def dispatch_pending():
+        timers['dispatch'] = None
+        items = list(pending)
+        del pending[:]
+        LOG.debug("dispatching %d message(s)", len(items))
+        schedule_cleanup(dispatch.dispatch_batch(items))
+        OUTPUT.flush()
+
+    def on_message(when, host, routing_key, body):
+        msg = decode_queued_message(when, host, body)
+        if msg is None:
+            return
+        pending.append((when, host, routing_key, msg))
+        if timers['dispatch'] is None:
+            timers['dispatch'] = ioloop.call_later(0, dispatch_pending)
+
+    consumers = [SelectConsumer(ioloop, server, on_message) for server in servers]
+
+    if opts.timeout:
+        LOG.info("priming timeout for %s seconds", opts.timeout)
+        signal(SIGALRM, handle_timeout)
+        alarm(opts.timeout)
+
+    rc = 0
+    try:
+        for consumer in consumers:
+            consumer.start()
+        ioloop.start()
+    except KeyboardInterrupt as solongandthanksforallthefish:
+        LOG.warning("keyboard interrupt, exiting")
+    except TimeoutException as zzz:
+        LOG.warning("timeout due to no messages emitted, exiting")
+        rc = 2
+    for consumer in consumers:
+        try:
+            consumer.stop()
+        except Exception:
+            LOG.debug("error closing connection to %s", consumer.host, exc_info=True)
+    LOG.debug("goodbye")
+    return rc
+
+
 def single_main(server_params, opts, args, extra_eval_namespace):
     """single-server main without multiprocessing
     """
@@ -626,10 +1156,28 @@ def single_main(server_params, opts, args, extra_eval_namespace):
         server_params['key'] = args[0]
     session = AmqpExchange(**server_params)
 
+    if opts.raw:
+        # pass message bodies through as received, without decoding and re-encoding the JSON
+        LOG.info("raw mode, writing message bodies as received")
+        if opts.timeout:
+            signal(SIGALRM, handle_timeout)
+            alarm(opts.timeout)
+        try:
+            session.consume(raw_emit, timeout=opts.timeout, decode=False)
+        except KeyboardInterrupt as solongandthanksforallthefish:
+            LOG.warning("keyboard interrupt, exiting")
+            return 0
+        except TimeoutException as zzz:
+            LOG.warning("timeout due to no messages emitted, exiting")
+            return 1
+        finally:  # send the batched acknowledgements on every way out
+            session.close()
+        return 0
+
     LOG.debug("creating payload transforms")
     transforms = Transforms(opts.transforms, extra_eval_namespace)
     LOG.debug("creating message dispatcher")
-    extra_defaults = {'__reception_host__': server_params['host']}
+    extra_defaults = {KEY_RECEPTION_HOST: server_params['host']}
     dispatch = Dispatcher(transforms, extra_eval_namespace, opts, extra_defaults)
 
     def callback(routing_key, body, dispatch=dispatch):
@@ -656,28 +1204,29 @@ def single_main(server_params, opts, args, extra_eval_namespace):
     except TimeoutException as zzz:
         LOG.warning("timeout due to no messages emitted, exiting")
         return 1
-    session.close()
+    finally:  # send the batched acknowledgements on every way out
+        session.close()
     return 0
 
 
 def zap(*seqs):
     """zip, but with basic broadcasting and length consistency checks
     """
-    seqs = [(list(s) if (s is not None) else []) for s in seqs]
+    seqs = [(s if isinstance(s, (list, tuple)) else list(s)) if (s is not None) else [] for s in seqs]
     iters = max([len(q) for q in seqs])
-    lens = [len(s) for s in seqs]
-    for i in range(iters):
-        z = []
-        for n,el in zip(lens,seqs):
-            if n==0:
-                z.append(None)
-            elif n==1:
-                z.append(el[0])
-            elif n==iters:
-                z.append(el[i])
-            else:
-                raise ValueError('inconsistent number of values is ambiguous, need %d more after %s' % (iters-n, repr(el)))
-        yield tuple(z)
+    lanes = []
+    for el in seqs:
+        n = len(el)
+        if n==0:
+            lanes.append(repeat(None, iters))
+        elif n==1:
+            lanes.append(repeat(el[0], iters))
+        elif n==iters:
+            lanes.append(iter(el))
+        else:
+            raise ValueError('inconsistent number of values is ambiguous, need %d more after %s' % (iters-n, repr(el)))
+    for z in zip(*lanes):
+        yield z
 
 USAGE="""Subscribes to and outputs messages from one or more AMQP server generating JSON dictionary payloads.
 Typically writes out single line of text per message emitted. 
@@ -731,10 +1280,18 @@ def main(add_options=[], **extra_eval_namespace):
                         help='parse content as json and print this expression using python string.format(). -j \'?\' for easy-to-read debug output. -j \'*\' for null-terminated [topic, contentdict] JSON for use with xargs -0 -n1')
     parser.add_option('-c', '--callback', dest='callback', default=None,
                         help="name of custom python function of form callback(topic: str, content: dict) to emit messages (see guide; for advanced users)")
+    parser.add_option('--raw', dest='raw', action='store_true', default=False,
+                        help='single server only: write "topic: body" with each message body exactly as received, skipping JSON decoding; cannot be combined with -j, -c, -T')
     parser.add_option('-T', '--transform', dest='transforms', action="append",
                         help='pythonic transform content of selected message key before output, e.g. "path=path.replace(\'/here\', \'/there\')" [MULTIPLE ALLOWED]')
     parser.add_option('-t', '--timeout', dest='timeout', type=int, default=0,
                         help='exit with error if no messages emitted for N seconds')
+    parser.add_option('--prefetch', dest='prefetch', type=int, default=DEFAULT_PREFETCH_COUNT,
+                        help='number of unacknowledged messages each server may send ahead, default %default')
+    parser.add_option('--single-process', dest='single_process', action='store_true', default=False,
+                        help='with multiple servers, consume all of them from one process instead of a process per server (requires pika >= 1.0)')
+    parser.add_option('--flush-every', dest='flush_every', type=int, default=None,
+                        help='flush output after N messages instead of after every message; output is also flushed when idle (within 1s for a single server). Multiple servers default to flushing after each batch of received messages')
     parser.add_option('-i', '--id', dest='id', default=None,
                         help='dummy argument to help identify an amqpfind process amongst all other amqpfind processes. Not used anywhere in the code')
 
@@ -768,7 +1325,7 @@ def main(add_options=[], **extra_eval_namespace):
 
     # set up additional symbols to make available in key/score/transform expressions
     if extra_eval_namespace:
-        LOG.info("extra symbols for evaluation namespace: %s" % repr(tuple(sorted(extra_eval_namespace.keys()))))
+        LOG.info("extra symbols for evaluation namespace: %r", tuple(sorted(extra_eval_namespace.keys())))
 
     servers = []
     for host, exchange, user, passwd, consume, durable in zap(opts.hosts, opts.exchanges, opts.users, opts.passwds, opts.consumes, opts.durables):
@@ -776,7 +1333,13 @@ def main(add_options=[], **extra_eval_namespace):
                             user=user, password=passwd,
                             key=consume, json=opts.json,
                             timeout=opts.timeout, durable=True if durable=="@" else durable))
-    LOG.info('server settings: ' + repr(servers))
+    prefetch = opts.prefetch
+    if opts.score is not None:
+        # keep enough messages in flight that every server can compete within a scoring window
+        prefetch = max(prefetch, len(servers) * 4)
+    for server in servers:
+        server['prefetch_count'] = prefetch
+    LOG.info('server settings: %r', servers)
 
     if opts.produce is not None:
         assert(len(servers)==1)  # for now, only support send to single server
@@ -786,12 +1349,25 @@ def main(add_options=[], **extra_eval_namespace):
         session.produce(content, key=opts.produce, exchange=opts.exchange)
         return 0
 
+    if opts.raw and ((len(servers) != 1) or (opts.json is not None) or opts.callback or opts.transforms):
+        LOG.error("--raw requires a single server and no -j, -c or -T options")
+        return 1
+
+    if opts.flush_every is not None:
+        OUTPUT.max_pending = max(1, opts.flush_every)
+    elif len(servers) > 1:
+        OUTPUT.max_pending = DEFAULT_DISPATCH_BATCH  # the dispatch loops flush once they are caught up
+
     if len(servers)==1:  # classical configuration
         if opts.key or opts.window or opts.score:
             LOG.error("Key, Window, and Score options require multiple servers to operate")
             return 1
         return single_main(servers[0], opts, args, extra_eval_namespace)
+    elif opts.single_process and PIKA_MAJOR_VERSION >= 1:  # more than one server on one IOLoop
+        return select_main(servers, opts, args, extra_eval_namespace)
     else:  # more than one server, time for multiprocessing
+        if opts.single_process:
+            LOG.warning("--single-process requires pika >= 1.0, using a process per server")
         return multi_main(servers, opts, args, extra_eval_namespace)
 
 
@@ -15,19 +15,32 @@ from datetime import datetime, timedelta
 
 
 @contextmanager
-def signalcontext(signum: int, handler: tp.Callable):
-    """Context manager that changes a signal handler on entry and resets it
-    on exit.
+def signalcontext(signums: int | tp.Iterable[int], handler: tp.Callable):
+    """Context manager that changes signal handlers on entry and resets
+    them on exit.
 
     Args:
-        signum (int): Signal to change.
+        signums (int | tp.Iterable[int]): Signal or signals to change.
         handler (tp.Callable): New signal handler to use.
     """
+    if isinstance(signums, int):
+        signums = (signums,)
+    orig_hs = []
     try:
-        orig_h = signal.signal(signum, handler)
+        for signum in signums:
+            orig_hs.append((signum, signal.signal(signum, handler)))
         yield
     finally:
-        signal.signal(signum, orig_h)
+        for signum, orig_h in reversed(orig_hs):
+            signal.signal(signum, orig_h)
+
+
+# Signals that end the process cleanly, SIGHUP where the platform has it.
+EXIT_SIGNALS = tuple(
+    getattr(signal, name)
+    for name in ("SIGINT", "SIGTERM", "SIGHUP")
+    if hasattr(signal, name)
+)
 
 
 def __raise_interrupt(_sig, _frame):  # noqa: ARG001
@@ -39,13 +52,13 @@ def clean_exit(
     original_func=None, *, cleanup_func: tp.Callable[[], None] | None = None
 ):
     """Decorator that runs a function and cleanly exits after
-    EOFErrors and termination signals (SIGINT, SIGTERM).
+    EOFErrors and termination signals (SIGINT, SIGTERM, SIGHUP).
     """
 
     def _decorate(function):
         @functools.wraps(function)
         def wrapper(*args, **kwargs):
-            with signalcontext(signal.SIGTERM, __raise_interrupt):
+            with signalcontext(EXIT_SIGNALS, __raise_interrupt):
                 try:
                     return function(*args, **kwargs)
                 except (EOFError, KeyboardInterrupt):
@@ -3,15 +3,46 @@ sat_latency.env
 ~~~~~~~~~~~~~~~
 
 Variables that can optionally be retrieved from the environment.
+
+Each value is parsed once per process, on first use, by its accessor.
 """
 
+import functools
 import os
+from typing import Any
+
+
+@functools.lru_cache(maxsize=None)
+def latency_dir() -> str:
+    """The directory that holds the latency data files."""
+    return os.getenv("SAT_LATENCY_DIR", os.path.join(os.curdir, "latencies"))
+
+
+@functools.lru_cache(maxsize=None)
+def batch_max_size() -> int:
+    """How many messages to ingest before writing to file."""
+    return int(os.getenv("SAT_LATENCY_BATCH_SIZE", 1024))
+
+
+@functools.lru_cache(maxsize=None)
+def batch_max_delay() -> int:
+    """How long to wait when there are no messages before writing to file."""
+    return int(os.getenv("SAT_LATENCY_BATCH_DELAY", 120))
+
 
-# The directory that holds the latency data files.
-LATENCY_DIR = os.getenv("SAT_LATENCY_DIR", os.path.join(os.curdir, "latencies"))
+# Kept for code that imports the values directly, resolved on first access
+# rather than at import so they are parsed lazily too.
+_CONSTANTS = {
+    "LATENCY_DIR": latency_dir,
+    "BATCH_MAX_SIZE": batch_max_size,
+    "BATCH_MAX_DELAY": batch_max_delay,
+}
 
-# How many messages to ingest before writing to file.
-BATCH_MAX_SIZE = int(os.getenv("SAT_LATENCY_BATCH_SIZE", 1024))
 
-# How long to wait when there are no messages before writing to file.
-BATCH_MAX_DELAY = int(os.getenv("SAT_LATENCY_BATCH_DELAY", 120))
+def __getattr__(name: str) -> Any:
+    try:
+        return _CONSTANTS[name]()
+    except KeyError:
+        raise AttributeError(
+            "module %r has no attribute %r" % (__name__, name)
+        ) from None
@@ -8,6 +8,7 @@ Programatic/command line interface to interact with satellite data.
 from __future__ import annotations
 
 import argparse
+import functools
 import json
 import os
 import sys
@@ -16,16 +17,40 @@ from datetime import datetime as dt
 from datetime import time
 from datetime import timedelta as td
 from datetime import timezone as tz
-from typing import Any
+from typing import Any, Iterable, TextIO
 
 import polars as pl
 import pyarrow.compute as pc
 
 from sat_latency._utils import clean_exit
-from sat_latency.env import LATENCY_DIR
+from sat_latency.env import latency_dir
 from sat_latency.pipeline import STORAGE_SCHEMA, read_satellite_data
 
 
+@functools.lru_cache(maxsize=256)
+def _datetime_from_iso(strtime: str) -> dt | None:
+    """Parses an ISO formatted datetime or date. These don't depend on the
+    current time, so the results are cached.
+
+    Args:
+        strtime (str): The time string.
+
+    Raises:
+        ValueError: A value cannot be parsed from the string.
+
+    Returns:
+        dt | None: The parsed datetime object, None if the string is not
+        a datetime or date.
+    """
+    if "T" in strtime:
+        return dt.fromisoformat(strtime).replace(tzinfo=tz.utc)
+    elif ":" in strtime:
+        return None
+    elif "-" in strtime:
+        return dt.combine(date.fromisoformat(strtime), time.min, tzinfo=tz.utc)
+    return None
+
+
 def date_or_time_type(strtime: str) -> dt:
     """Parses a string passed into the program into a datetime. The string
     can be an ISO formatted date, time, or datetime, or 'now' for the current
@@ -40,14 +65,13 @@ def date_or_time_type(strtime: str) -> dt:
     Returns:
         dt: The parsed datetime object.
     """
-    if "T" in strtime:
-        return dt.fromisoformat(strtime).replace(tzinfo=tz.utc)
+    parsed = _datetime_from_iso(strtime)
+    if parsed is not None:
+        return parsed
     elif ":" in strtime:
         return dt.combine(
             date.today(), time.fromisoformat(strtime), tzinfo=tz.utc
         )
-    elif "-" in strtime:
-        return dt.combine(date.fromisoformat(strtime), time.min, tzinfo=tz.utc)
     elif strtime.lower() == "now":
         return dt.now(tz.utc)
     raise ValueError(
@@ -73,7 +97,7 @@ def parse_interface_args() -> argparse.Namespace:
         "--database-dir",
         dest="db_dest",
         type=str,
-        default=LATENCY_DIR,
+        default=latency_dir(),
         help="Path to top level directory that contains latency db information.",
     )
 
@@ -222,6 +246,48 @@ def json_serialize(non_serializable: Any):
     raise ValueError
 
 
+def write_json_rows(
+    rows: Iterable[dict[str, Any]],
+    out: TextIO,
+    indent: int | None = None,
+    lines: bool = False,
+) -> None:
+    """Write rows as JSON one at a time, so the whole result is never held
+    as Python objects. The output is the same as json.dumps of the list of
+    rows, followed by a newline.
+
+    Args:
+        rows (Iterable[dict[str, Any]]): The rows to write.
+        out (TextIO): Where to write the rows.
+        indent (int | None, optional): JSON indent. Defaults to None.
+        lines (bool, optional): Write one row per line instead of a JSON
+        array. Defaults to False.
+    """
+    encoder = json.JSONEncoder(indent=indent, default=json_serialize)
+    if lines:
+        for row in rows:
+            out.write(encoder.encode(row))
+            out.write("\n")
+        return
+
+    if indent is None:
+        opening, separator, prefix, closing = "[", ", ", "", "]\n"
+    else:
+        opening, separator, prefix, closing = (
+            "[\n",
+            ",\n",
+            " " * indent,
+            "\n]\n",
+        )
+    written = False
+    for row in rows:
+        out.write(separator if written else opening)
+        out.write(prefix + encoder.encode(row).replace("\n", "\n" + prefix))
+        written = True
+    # json.dumps writes an empty list the same way with or without indent
+    out.write(closing if written else "[]\n")
+
+
 def satellite_data_from_filters(
     base_dir: str,
     start_date: dt,
@@ -280,7 +346,7 @@ def satellite_data_from_filters(
 def main():
     args = parse_interface_args()
 
-    db_dest = args.db_dest or LATENCY_DIR
+    db_dest = args.db_dest or latency_dir()
 
     df = satellite_data_from_filters(
         base_dir=db_dest,
@@ -307,13 +373,9 @@ def main():
     indent = 4 if "pretty" in args.output else None
     lines = True if "lines" in args.output else False
 
-    d_list = df.to_dicts()
-
-    if not lines:
-        print(json.dumps(d_list, indent=indent, default=json_serialize))
-    else:
-        for d in d_list:
-            print(json.dumps(d, indent=indent, default=json_serialize))
+    write_json_rows(
+        df.iter_rows(named=True), sys.stdout, indent=indent, lines=lines
+    )
 
 
 if __name__ == "__main__":
@@ -8,22 +8,37 @@ Entrypoint to run the TL parts of the pipeline.
 from __future__ import annotations
 
 import argparse
+import functools
 import logging
+import os
+import stat
 import sys
 import time
 from collections import defaultdict
 from datetime import date
 
+import pyarrow.compute as pc
+
 from sat_latency._utils import clean_exit
-from sat_latency.env import BATCH_MAX_DELAY, BATCH_MAX_SIZE, LATENCY_DIR
-from sat_latency.pipeline.extract import read_input
+from sat_latency.env import batch_max_delay, batch_max_size, latency_dir
+from sat_latency.pipeline.extract import (
+    INGEST_FIELDS,
+    read_input,
+    read_input_batches,
+)
 from sat_latency.pipeline.load import BatchWriter
 from sat_latency.pipeline.transform import (
     STORAGE_SCHEMA,
-    storage_batch_from_list,
+    storage_batch_from_rows,
+    storage_batch_from_strings,
 )
 
 PARTITION_KEY = "start_time"
+_PARTITION_INDEX = INGEST_FIELDS.index(PARTITION_KEY)
+_TOPIC_INDEX = INGEST_FIELDS.index("topic")
+
+# Check the clock for BATCH_MAX_DELAY every this many messages (power of 2).
+CLOCK_CHECK_INTERVAL = 64
 
 
 def parse_pipeline_args() -> argparse.Namespace:
@@ -74,40 +89,118 @@ def init() -> None:
     )
 
 
-def run():
-    """Run the pipeline."""
-    batch_size = 0
-    batch_time = time.time()
-
-    data: dict[date, list[dict[str, bytes]]] = defaultdict(list)
-    with BatchWriter(LATENCY_DIR, STORAGE_SCHEMA) as writer:
-        for point in read_input(sys.stdin.buffer):
-            try:
-                partition = date.fromisoformat(
-                    point[PARTITION_KEY].decode("utf-8")[:10]
-                )
-            except ValueError:
-                logging.warning(
-                    "Couldn't decode start date for %s" % point["topic"]
+@functools.lru_cache(maxsize=4)
+def _partition_from_bytes(prefix: bytes) -> int:
+    """Parse the partition date from the first 10 bytes of a start time,
+    as its ordinal so the hot loop can key its buffers by int.
+    Consecutive messages almost always share a date, so this is cached.
+    """
+    return date.fromisoformat(prefix.decode("utf-8")).toordinal()
+
+
+def _is_regular_file(source) -> bool:
+    """Whether source is a file, as opposed to a pipe from the ingestor."""
+    try:
+        return stat.S_ISREG(os.fstat(source.fileno()).st_mode)
+    except (OSError, ValueError, AttributeError):
+        return False
+
+
+def run_file(source) -> None:
+    """Run the pipeline on a file redirected to stdin, e.g. to load saved
+    ingestor output. The whole input is available, so it is parsed in large
+    blocks instead of line by line.
+    """
+    with BatchWriter(latency_dir(), STORAGE_SCHEMA) as writer:
+        for batch in read_input_batches(source):
+            dates = pc.utf8_slice_codeunits(batch.column(PARTITION_KEY), 0, 10)
+            for day in pc.unique(dates).to_pylist():
+                mask = (
+                    pc.is_null(dates) if day is None else pc.equal(dates, day)
                 )
-                continue
-            logging.debug("Got %s" % point["topic"])
-            data[partition].append(point)
-            batch_size += 1
-
-            if (
-                batch_size < BATCH_MAX_SIZE
-                and time.time() - batch_time < BATCH_MAX_DELAY
-            ):
-                continue
-            for partition, data_list in data.items():
+                try:
+                    partition = date.fromisoformat(day)
+                except (TypeError, ValueError):
+                    logging.warning(
+                        "Couldn't decode start date for %d messages",
+                        pc.sum(mask).as_py(),
+                    )
+                    continue
                 logging.info("Writing batches for %s" % str(partition))
                 writer.write_batch(
-                    storage_batch_from_list(data_list), partition
+                    storage_batch_from_strings(batch.filter(mask)), partition
                 )
-            data.clear()
-            batch_size = 0
-            batch_time = time.time()
+
+
+def _write_partitions(
+    writer: BatchWriter, data: dict[int, list[list[bytes | None]]]
+) -> None:
+    """Write the buffered messages of each partition, keyed by the ordinal
+    of its date, removing each from the buffer as it is written.
+    """
+    while data:
+        ordinal = next(iter(data))
+        rows = data.pop(ordinal)
+        partition = date.fromordinal(ordinal)
+        logging.info("Writing batches for %s" % str(partition))
+        writer.write_batch(storage_batch_from_rows(rows), partition)
+
+
+def run():
+    """Run the pipeline."""
+    if _is_regular_file(sys.stdin.buffer):
+        return run_file(sys.stdin.buffer)
+
+    max_size = batch_max_size()
+    max_delay = batch_max_delay()
+    clock_mask = CLOCK_CHECK_INTERVAL - 1
+    now = time.time
+
+    batch_size = 0
+    batch_time = now()
+
+    def timeout() -> float | None:
+        # Wake up in time to write an open batch when the input goes quiet
+        if not batch_size:
+            return None
+        return max(0.0, batch_time + max_delay - now())
+
+    data: dict[int, list[list[bytes | None]]] = defaultdict(list)
+    with BatchWriter(latency_dir(), STORAGE_SCHEMA) as writer:
+        try:
+            for point in read_input(sys.stdin.buffer, timeout):
+                if point is None:
+                    # No input before the batch's deadline
+                    batch_time = now()
+                    batch_size = 0
+                    _write_partitions(writer, data)
+                    continue
+                try:
+                    partition = _partition_from_bytes(
+                        point[_PARTITION_INDEX][:10]
+                    )
+                except (TypeError, ValueError):
+                    logging.warning(
+                        "Couldn't decode start date for %s"
+                        % point[_TOPIC_INDEX]
+                    )
+                    continue
+                logging.debug("Got %s" % point[_TOPIC_INDEX])
+                data[partition].append(point)
+                batch_size += 1
+
+                if batch_size < max_size and (
+                    batch_size & clock_mask or now() - batch_time < max_delay
+                ):
+                    continue
+                # Measure the delay from the start of this write, so slow
+                # writes don't stretch the time between flushes
+                batch_time = now()
+                batch_size = 0
+                _write_partitions(writer, data)
+        finally:
+            # Don't lose the last messages at EOF or on a termination signal.
+            _write_partitions(writer, data)
 
 
 if __name__ == "__main__":
@@ -8,14 +8,22 @@ sat_latency_pipeline script installed with the package.
 
 from __future__ import annotations
 
+import logging
+import os
+import select
 import sys
-from typing import BinaryIO, Generator
+from collections import deque
+from typing import BinaryIO, Callable, Generator, Iterable
 
 import pyarrow as pa
+import pyarrow.csv as pacsv
 
 from amqpfind.amqpfind import _missing_
 
 # These fields MUST match the -j option from the sat_latency_pipeline script.
+# The ingestor writes them as UTF-8 (the script sets PYTHONIOENCODING). The
+# pipeline views the bytes as strings and validates each column in one pass
+# (see transform._utf8_array), so invalid input raises instead of being stored.
 INGEST_FIELDS = [
     "topic",
     "band",
@@ -36,40 +44,159 @@ INGEST_SEPARATOR = b"!"
 
 def read_input(
     source: BinaryIO | None = None,
-) -> Generator[dict[str, bytes | None], None, None]:
+    timeout: Callable[[], float | None] | None = None,
+) -> Generator[list[bytes | None] | None, None, None]:
+    """Read the ingestor lines one at a time.
+
+    Args:
+        source (BinaryIO | None, optional): Input to read. Defaults to stdin.
+        timeout (Callable[[], float | None] | None, optional): Returns how
+        many seconds to wait for more input before yielding None, or None
+        to wait until there is some. Defaults to always waiting.
+
+    Yields:
+        list[bytes | None] | None: The fields of each line, in the order of
+        INGEST_FIELDS, None for empty or missing fields. None when no line
+        arrived before the timeout.
+    """
     if source is None:
         source = sys.stdin.buffer
-    for line in iter(source.readline, b""):
-        yield {
-            name: value
-            for name, value in zip(INGEST_FIELDS, fields_from_line(line))
-        }
+    n_fields = len(INGEST_FIELDS)
+    lines: Iterable[bytes | None] = (
+        source if timeout is None else _read_lines(source.fileno(), timeout)
+    )
+    for line in lines:
+        if line is None:
+            yield None
+            continue
+        yield _pad_fields(fields_from_line(line), n_fields)
+
+
+def _pad_fields(
+    fields: list[bytes | None], n_fields: int = len(INGEST_FIELDS)
+) -> list[bytes | None]:
+    """Pad missing fields with None and drop extra ones, so malformed lines
+    are kept with the fields they have.
+    """
+    if len(fields) != n_fields:
+        fields = (fields + [None] * n_fields)[:n_fields]
+    return fields
+
+
+def _read_lines(
+    fd: int, timeout: Callable[[], float | None], chunk_size: int = 1 << 16
+) -> Generator[bytes | None, None, None]:
+    """Read lines straight from a file descriptor, waiting at most the
+    given timeout for each chunk. A buffered reader can't be used here, as
+    lines it already read ahead wouldn't make the descriptor readable.
+
+    Args:
+        fd (int): The file descriptor to read.
+        timeout (Callable[[], float | None]): Returns the seconds to wait for
+        the next chunk, or None to wait until there is one.
+        chunk_size (int, optional): Most bytes to read at a time.
+        Defaults to 64KiB.
+
+    Yields:
+        bytes | None: Each line without its newline, or None when nothing
+        could be read before the timeout.
+    """
+    pending = b""
+    while True:
+        wait = timeout()
+        if wait is not None and not select.select([fd], [], [], wait)[0]:
+            yield None
+            continue
+        chunk = os.read(fd, chunk_size)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
 
 
-def fields_from_line(line: bytes) -> Generator[bytes | None, None, None]:
+def fields_from_line(line: bytes) -> list[bytes | None]:
     """Load the fields of of schema from bytes.
 
     Args:
         b (bytes): The bytes object for one line from the ingestor.
 
+    Returns:
+        list[bytes | None]: Each field from the schema, None for empty or
+        missing fields.
+    """
+    # bytes.split finds the separators in C instead of reading byte by byte
+    return [
+        None if not field or field == AMQPFIND_MISSING else field
+        for field in line.rstrip(b"\n").split(INGEST_SEPARATOR)
+    ]
+
+
+def read_input_batches(
+    source: BinaryIO | None = None, block_size: int = 1 << 20
+) -> Generator[pa.RecordBatch, None, None]:
+    """Read the ingestor lines in blocks with Arrow's CSV reader instead of
+    one line at a time. Every block must be complete before it is parsed,
+    so this is meant for files rather than a live stream.
+
+    Lines with the wrong number of fields are padded or truncated like
+    read_input does. The CSV reader can only skip them, so they are yielded
+    in a batch of their own after the block they were found in.
+
+    Args:
+        source (BinaryIO | None, optional): Input to read. Defaults to stdin.
+        block_size (int, optional): Bytes to parse at a time.
+        Defaults to 1MiB.
+
     Yields:
-        Generator[pa.Buffer | None, None, None]: Each field from the schema,
-        one at a time.
+        Generator[pa.RecordBatch, None, None]: A batch of string columns
+        named by INGEST_FIELDS, null for empty or missing fields.
+    """
+    if source is None:
+        source = sys.stdin.buffer
+    # The handler may run on the reader's threads
+    malformed: deque[str] = deque()
+
+    def keep_invalid_row(row: pacsv.InvalidRow) -> str:
+        logging.warning("Padding malformed line %s: %s", row.number, row.text)
+        malformed.append(row.text)
+        return "skip"
+
+    reader = pacsv.open_csv(
+        source,
+        read_options=pacsv.ReadOptions(
+            column_names=INGEST_FIELDS, block_size=block_size
+        ),
+        parse_options=pacsv.ParseOptions(
+            delimiter=INGEST_SEPARATOR.decode("utf-8"),
+            quote_char=False,
+            escape_char=False,
+            invalid_row_handler=keep_invalid_row,
+        ),
+        convert_options=pacsv.ConvertOptions(
+            column_types={name: pa.string() for name in INGEST_FIELDS},
+            null_values=["", AMQPFIND_MISSING.decode("utf-8")],
+            strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        yield batch
+        if malformed:
+            yield _batch_from_lines(malformed)
+    if malformed:
+        yield _batch_from_lines(malformed)
+
+
+def _batch_from_lines(lines: deque[str]) -> pa.RecordBatch:
+    """Turn the lines taken from a queue into a batch of string columns
+    named by INGEST_FIELDS, split like read_input splits them.
     """
-    with pa.input_stream(pa.py_buffer(line)) as stream:
-        p_index = 0
-        p_size = 0
-        while True:
-            byte = stream.read(1)
-            if not byte:
-                return
-            elif byte == INGEST_SEPARATOR or byte == b"\n":
-                field = stream.read_at(p_size, p_index)
-                if not field or field == AMQPFIND_MISSING:
-                    yield None
-                else:
-                    yield field
-                p_index = p_index + p_size + 1
-                p_size = 0
-            else:
-                p_size += 1
+    rows = []
+    while lines:
+        rows.append(_pad_fields(fields_from_line(lines.popleft().encode())))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, pa.string()) for column in zip(*rows)],
+        names=INGEST_FIELDS,
+    )
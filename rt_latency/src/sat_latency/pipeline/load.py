@@ -10,13 +10,15 @@ from __future__ import annotations
 
 import datetime as dt
 import functools
+import itertools
 import os
-from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Generator
 
 import polars as pl
 import pyarrow as pa
 import pyarrow.compute as pc
+import pyarrow.dataset as ds
 
 from sat_latency._utils import daterange
 from sat_latency.pipeline.transform import STORAGE_SCHEMA
@@ -38,6 +40,24 @@ def _path_stub_from_date(date: dt.date) -> str:
     return date.strftime("%Y/%Y_%m/%Y_%m_%d_latencies.arrows")
 
 
+@functools.lru_cache(maxsize=32)
+def _map_file(path: str, _size: int, _mtime_ns: int) -> pa.Buffer:
+    """Memory maps a latency file, reusing the mapping across queries. The
+    size and modification time are part of the cache key, so a file that
+    was written to since it was mapped is mapped again.
+
+    Args:
+        path (str): The file to map.
+        _size (int): The size of the file.
+        _mtime_ns (int): The modification time of the file.
+
+    Returns:
+        pa.Buffer: Zero-copy buffer over the whole file.
+    """
+    with pa.memory_map(path, "r") as source:
+        return source.read_buffer()
+
+
 def _yield_batches(*files: str) -> Generator[pa.RecordBatch, None, None]:
     """Given a set of Apache Arrow files, load RecordBatches from
     all of them
@@ -46,8 +66,17 @@ def _yield_batches(*files: str) -> Generator[pa.RecordBatch, None, None]:
         Generator[pa.RecordBatch, None, None]: All record batches in files.
     """
     for file in files:
-        with pa.memory_map(file, "r") as source:
-            with pa.ipc.open_stream(source) as reader:
+        stat = os.stat(file)
+        buffer = _map_file(file, stat.st_size, stat.st_mtime_ns)
+        source = pa.BufferReader(buffer)
+        # Every time BatchWriter reopens a file it appends a new stream
+        while source.tell() < buffer.size:
+            try:
+                reader = pa.ipc.open_stream(source)
+            except pa.ArrowInvalid:
+                # Trailing bytes from an interrupted write
+                break
+            with reader:
                 while True:
                     try:
                         yield reader.read_next_batch()
@@ -98,11 +127,20 @@ def read_satellite_data(
     Returns:
         pl.DataFrame: A dataframe with the latency data.
     """
-    tbl = pa.Table.from_batches(
-        _yield_batches(*_files_from_date_range(base_dir, date_from, date_until))
+    batches = _yield_batches(
+        *_files_from_date_range(base_dir, date_from, date_until)
     )
-    if arrow_filter is not None:
-        tbl = tbl.filter(arrow_filter)
+    first = next(batches, None)
+    if first is None:
+        tbl = STORAGE_SCHEMA.empty_table()
+    else:
+        # Arrow's scanner evaluates the whole filter on each batch as it is
+        # read, so the unfiltered data is never materialized as one table
+        tbl = ds.Scanner.from_batches(
+            itertools.chain((first,), batches),
+            schema=first.schema,
+            filter=arrow_filter,
+        ).to_table()
     tbl = tbl.cast(STORAGE_SCHEMA)
 
     # calculate the latency
@@ -119,7 +157,9 @@ def read_satellite_data(
             1000.0,
         ),
     )
-    return pl.from_arrow(tbl)  # type: ignore
+    # Keep Arrow's chunks as they are instead of copying every column into
+    # one contiguous buffer
+    return pl.from_arrow(tbl, rechunk=False)  # type: ignore
 
 
 class BatchWriter:
@@ -129,11 +169,21 @@ class BatchWriter:
         self._base_dir = base_dir
         if not os.path.isdir(base_dir):
             os.mkdir(base_dir)
-        self._writer_pool: OrderedDict[
+        # Least recently used first; dicts keep insertion order
+        self._writer_pool: dict[
             dt.date, tuple[pa.OSFile, pa.RecordBatchStreamWriter]
-        ] = OrderedDict()
+        ] = {}
         self._max_size = pool_size
         self._schema = schema
+        # Arrow releases the GIL while writing, so batches are written in the
+        # background while the caller builds the next ones. There is at most
+        # one pending write per date, which keeps each file's batches in order
+        self._executor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="BatchWriter"
+        )
+        self._pending: dict[dt.date, Future] = {}
+        # Directories already created, so a churning pool doesn't stat them
+        self._ensured_dirs: set[str] = set()
 
     @property
     def base_dir(self) -> str:
@@ -146,35 +196,61 @@ class BatchWriter:
     def _get_writer(self, date: dt.date) -> pa.RecordBatchStreamWriter:
         writer = self._writer_pool.get(date)
         if writer is not None:
-            self._writer_pool.move_to_end(date)
+            # Consecutive batches mostly go to the same date, which is then
+            # already the most recently used one
+            if next(reversed(self._writer_pool)) != date:
+                del self._writer_pool[date]
+                self._writer_pool[date] = writer
             return writer[1]
         path = os.path.join(self._base_dir, _path_stub_from_date(date))
-        os.makedirs(os.path.dirname(path), exist_ok=True)
+        directory = os.path.dirname(path)
+        if directory not in self._ensured_dirs:
+            os.makedirs(directory, exist_ok=True)
+            self._ensured_dirs.add(directory)
         file = pa.OSFile(path, mode="ab")
         new_writer = pa.ipc.new_stream(file, self._schema)
         if len(self._writer_pool) >= self._max_size:
             old_date = next(iter(self._writer_pool))
             self._close_date(old_date)
-            self._writer_pool.popitem(False)
+            del self._writer_pool[old_date]
         self._writer_pool[date] = (file, new_writer)
         return new_writer
 
     def write_batch(self, batch, date: dt.date) -> None:
         writer = self._get_writer(date)
-        writer.write_batch(batch)
+        self._wait(date)
+        self._pending[date] = self._executor.submit(writer.write_batch, batch)
+
+    def _wait(self, date: dt.date) -> None:
+        """Wait for the pending write to date, raising its errors."""
+        future = self._pending.pop(date, None)
+        if future is not None:
+            future.result()
 
     def _close_date(self, date: dt.date) -> None:
         value = self._writer_pool.get(date)
         if value is None:
             return
         file, writer = value
-        writer.close()
-        file.flush()
-        file.close()
+        try:
+            self._wait(date)
+        finally:
+            writer.close()
+            file.flush()
+            file.close()
 
     def close(self) -> None:
-        for date in self._writer_pool:
-            self._close_date(date)
+        try:
+            # Close the files in parallel, after their pending writes which
+            # were submitted to the same executor first
+            closing = [
+                self._executor.submit(self._close_date, date)
+                for date in self._writer_pool
+            ]
+            for future in closing:
+                future.result()
+        finally:
+            self._executor.shutdown()
 
     def __enter__(self) -> BatchWriter:
         return self
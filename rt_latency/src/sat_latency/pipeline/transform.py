@@ -5,6 +5,11 @@ sat_latency.pipeline.transform
 Transform logic for the satellite data pipeline.
 """
 
+from __future__ import annotations
+
+import operator
+from typing import Iterable, Sequence
+
 import pyarrow as pa
 import pyarrow.compute as pc
 
@@ -34,37 +39,146 @@ META_SCHEMA = pa.schema(
 
 # The field names MUST be the same as INGEST_FIELDS
 # in sat_latency.pipeline.extract
-STORAGE_SCHEMA = pa.unify_schemas([META_SCHEMA, TIME_SCHEMA])
+STORAGE_SCHEMA = pa.schema([*META_SCHEMA, *TIME_SCHEMA])
 _str_schema = pa.schema([pa.field(name, pa.string()) for name in INGEST_FIELDS])
+_ingest_getter = operator.itemgetter(*INGEST_FIELDS)
+_time_names = frozenset(TIME_SCHEMA.names)
+# Ingest times are UTC without an offset, so they are parsed as naive first.
+# Arrow stores timestamps as UTC, so tagging them with the zone afterwards is
+# a cast that leaves the values alone
+_naive_timestamp = pa.timestamp("us")
+_utc_timestamp = pa.timestamp("us", tz="UTC")
 
 
-def storage_batch_from_list(data: list[dict[str, bytes]]) -> pa.RecordBatch:
+def storage_batch_from_list(
+    data: list[dict[str, bytes]], columns: Sequence[str] | None = None
+) -> pa.RecordBatch:
     """Turn a list of dictionaries loaded from the ingestor into a
     record batch that can be written to disk.
 
     Args:
         data (list[dict[str, bytes]]): input data.
+        columns (Sequence[str] | None, optional): Only build these columns,
+        in the order of INGEST_FIELDS. Defaults to all of them.
+
+    Raises:
+        ValueError: A column is not one of INGEST_FIELDS.
 
     Returns:
         pa.RecordBatch: record batch.
     """
-    batch = pa.RecordBatch.from_pylist(data)
-    batch = batch.cast(_str_schema)
-    # turn time fields to timestamps
-    for i, name in enumerate(batch.column_names):
-        if name not in TIME_SCHEMA.names:
-            continue
-
-        batch = batch.set_column(
-            i,
-            name,
-            pc.assume_timezone(
-                pc.cast(
-                    batch.column(i),
-                    target_type=pa.timestamp("us"),
-                ),
-                "UTC",
-            ),
+    if columns is not None:
+        unknown = set(columns).difference(INGEST_FIELDS)
+        if unknown:
+            raise ValueError("Unknown columns %s" % ", ".join(sorted(unknown)))
+        names = [name for name in INGEST_FIELDS if name in columns]
+        return _storage_batch_from_columns(
+            ([row.get(name) for row in data] for name in names), names
         )
 
-    return batch.cast(STORAGE_SCHEMA)
+    # Transpose in Python instead of letting from_pylist inspect every dict
+    # and infer a schema that has to be cast afterwards
+    try:
+        rows = list(map(_ingest_getter, data))
+    except KeyError:
+        # Some rows are missing fields, fill them with nulls
+        return _storage_batch_from_columns(
+            [row.get(name) for row in data] for name in INGEST_FIELDS
+        )
+    return _storage_batch_from_columns(zip(*rows))
+
+
+def storage_batch_from_rows(
+    rows: list[list[bytes | None]],
+) -> pa.RecordBatch:
+    """Turn a list of rows loaded from the ingestor into a record batch
+    that can be written to disk. The rows are transposed into one array
+    per column.
+
+    Args:
+        rows (list[list[bytes | None]]): input data, the fields of each
+        row in the order of INGEST_FIELDS.
+
+    Returns:
+        pa.RecordBatch: record batch.
+    """
+    return _storage_batch_from_columns(zip(*rows))
+
+
+def _storage_batch_from_columns(
+    columns: Iterable[Sequence[bytes | None]],
+    names: Sequence[str] = INGEST_FIELDS,
+) -> pa.RecordBatch:
+    """Turn the columns of ingestor data into a record batch that can be
+    written to disk.
+
+    Args:
+        columns (Iterable[Sequence[bytes | None]]): input data.
+        names (Sequence[str], optional): The name of each column, in the
+        order of INGEST_FIELDS. Defaults to INGEST_FIELDS.
+
+    Returns:
+        pa.RecordBatch: record batch.
+    """
+    return _storage_batch_from_string_arrays(map(_utf8_array, columns), names)
+
+
+def _utf8_array(column: Sequence[bytes | None]) -> pa.Array:
+    """Turn a column of UTF-8 encoded bytes into a string array.
+
+    Args:
+        column (Sequence[bytes | None]): input data.
+
+    Raises:
+        pa.ArrowInvalid: The column is not valid UTF-8.
+
+    Returns:
+        pa.Array: string array.
+    """
+    # View the bytes as strings instead of decoding them with a cast, the
+    # full validation only checks the UTF-8 without copying the data
+    array = pa.array(column, pa.binary()).view(pa.string())
+    array.validate(full=True)
+    return array
+
+
+def storage_batch_from_strings(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """Turn a record batch of string columns named by INGEST_FIELDS into a
+    record batch that can be written to disk.
+
+    Args:
+        batch (pa.RecordBatch): input data.
+
+    Returns:
+        pa.RecordBatch: record batch.
+    """
+    return _storage_batch_from_string_arrays(batch.columns)
+
+
+def _storage_batch_from_string_arrays(
+    arrays: Iterable[pa.Array], names: Sequence[str] = INGEST_FIELDS
+) -> pa.RecordBatch:
+    """Turn string arrays into a record batch that can be written to disk.
+    The batch is only built once, from the converted arrays.
+
+    Args:
+        arrays (Iterable[pa.Array]): input data.
+        names (Sequence[str], optional): The name of each array, in the
+        order of INGEST_FIELDS. Defaults to INGEST_FIELDS.
+
+    Returns:
+        pa.RecordBatch: record batch, with STORAGE_SCHEMA narrowed to names.
+    """
+    if names is INGEST_FIELDS:
+        schema = STORAGE_SCHEMA
+    else:
+        schema = pa.schema([STORAGE_SCHEMA.field(name) for name in names])
+    storage_arrays = []
+    for name, array in zip(names, arrays):
+        # turn time fields to timestamps
+        if name in _time_names:
+            array = pc.cast(array, target_type=_naive_timestamp).cast(
+                _utc_timestamp
+            )
+        storage_arrays.append(array)
+    return pa.RecordBatch.from_arrays(storage_arrays, schema=schema)
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import io
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from sat_latency.interface import json_serialize, write_json_rows
+
+ROWS = [
+    {
+        "topic": "geo.goes.g16.abi",
+        "latency": 12.5,
+        "start_time": datetime(2024, 6, 20, 12, tzinfo=timezone.utc),
+        "band": None,
+    },
+    {"topic": "leo.noaa.n20.viirs", "latency": 3.0, "nested": {"a": [1, 2]}},
+    {"topic": "geo.himawari.h9.ahi", "latency": 7.25},
+]
+
+
+@pytest.mark.parametrize("n_rows", [0, 1, len(ROWS)])
+@pytest.mark.parametrize("indent", [None, 0, 4])
+def test_write_json_rows_matches_dumps(n_rows, indent):
+    """Writing rows one at a time gives the same output as json.dumps."""
+    rows = ROWS[:n_rows]
+    out = io.StringIO()
+    write_json_rows(iter(rows), out, indent=indent)
+    expected = json.dumps(rows, indent=indent, default=json_serialize)
+    assert out.getvalue() == expected + "\n"
+
+
+@pytest.mark.parametrize("n_rows", [0, 1, len(ROWS)])
+def test_write_json_rows_lines(n_rows):
+    """Lines mode writes one JSON document per row."""
+    rows = ROWS[:n_rows]
+    out = io.StringIO()
+    write_json_rows(iter(rows), out, lines=True)
+    expected = "".join(
+        json.dumps(row, default=json_serialize) + "\n" for row in rows
+    )
+    assert out.getvalue() == expected